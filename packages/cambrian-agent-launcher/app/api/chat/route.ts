@@ -10,6 +10,24 @@ let agentInstance: any = null;
 let agentConfig: any = null;
 let isAgentInitialized = false;
 
+// One agent run, recorded so a client retrying with the same Idempotency-Key
+// gets its result instead of running the agent (and its on-chain tools) again
+type AgentRun = {
+  events: { type: string; [key: string]: unknown }[];
+  done: boolean;
+  error?: string;
+  finished: Promise<void>;
+  listeners: Set<() => void>;
+  // Stops the agent; used when nobody can pick up the run's result any more
+  abort: AbortController;
+};
+
+// Keyed runs are kept this long after they finish
+const RUN_TTL_MS = 10 * 60 * 1000;
+// A JSON request waits at most this long for an unfinished run, then gets the partial result
+const RESULT_WAIT_MS = 25 * 1000;
+const agentRuns = new Map<string, AgentRun>();
+
 // Initialize the agent if not already done
 async function getAgent() {
   if (!agentInstance) {
@@ -28,9 +46,160 @@ async function getAgent() {
   return { agent: agentInstance, config: agentConfig, isInitialized: isAgentInitialized };
 }
 
+// Run the agent in the background, independently of any client connection
+function startRun(agent: any, config: any, latestMessage: string, key: string | null): AgentRun {
+  const run: AgentRun = {
+    events: [],
+    done: false,
+    finished: Promise.resolve(),
+    listeners: new Set(),
+    abort: new AbortController(),
+  };
+  const notify = () => run.listeners.forEach((listener) => {
+    try {
+      listener();
+    } catch (error) {
+      // A broken client stream must not stop the run itself
+      run.listeners.delete(listener);
+    }
+  });
+  const push = (event: AgentRun['events'][number]) => {
+    run.events.push(event);
+    notify();
+  };
+  
+  run.finished = (async () => {
+    try {
+      // Call the agent with the user message
+      const responseStream = await agent.stream(
+        { messages: [new HumanMessage(latestMessage)] },
+        { ...config, signal: run.abort.signal }
+      );
+      
+      // Process each chunk from the agent response
+      for await (const responseChunk of responseStream) {
+        run.abort.signal.throwIfAborted();
+        let content = '';
+        
+        if ("agent" in responseChunk) {
+          content = responseChunk.agent.messages[0].content;
+          // Announce tool calls so clients can tell which tool a slow stream is waiting on
+          for (const toolCall of responseChunk.agent.messages[0].tool_calls ?? []) {
+            push({ type: 'tool', name: toolCall.name });
+          }
+        } 
+        // else if ("tools" in responseChunk) {
+        //   content = responseChunk.tools.messages[0].content;
+        // }
+        if (content) {
+          push({ type: 'text', text: content });
+        }
+      }
+    } catch (error) {
+      if (run.abort.signal.aborted) {
+        run.error = 'Run cancelled';
+      } else {
+        console.error('Error in stream:', error);
+        run.error = error instanceof Error ? error.message : String(error);
+      }
+    } finally {
+      run.done = true;
+      notify();
+      if (key) {
+        setTimeout(() => agentRuns.delete(key), RUN_TTL_MS);
+      }
+    }
+  })();
+  
+  if (key) {
+    agentRuns.set(key, run);
+  }
+  return run;
+}
+
+// The run's text so far, one entry per streamed text chunk
+function runResult(run: AgentRun) {
+  const chunks = run.events
+    .filter((event) => event.type === 'text')
+    .map((event) => event.text as string);
+  return { text: chunks.join(''), chunks, done: run.done, error: run.error };
+}
+
+// Stream a run's events as NDJSON, replaying whatever it already produced.
+// Unless the run is kept for a retry, the client going away also stops the agent.
+function streamRun(run: AgentRun, keep: boolean): ReadableStream {
+  const encoder = new TextEncoder();
+  let listener: (() => void) | null = null;
+  
+  return new ReadableStream({
+    start(controller) {
+      let sent = 0;
+      listener = () => {
+        while (sent < run.events.length) {
+          controller.enqueue(encoder.encode(JSON.stringify(run.events[sent++]) + '\n'));
+        }
+        if (run.done) {
+          run.listeners.delete(listener!);
+          if (run.error) {
+            controller.error(new Error(run.error));
+          } else {
+            controller.close();
+          }
+        }
+      };
+      run.listeners.add(listener);
+      listener();
+    },
+    cancel() {
+      // The client went away; a keyed run carries on so a retry can pick up its result
+      if (listener) {
+        run.listeners.delete(listener);
+      }
+      if (!keep) {
+        run.abort.abort();
+      }
+    },
+  });
+}
+
+const STREAM_HEADERS = {
+  'Content-Type': 'text/event-stream',
+  'Cache-Control': 'no-cache',
+  'Connection': 'keep-alive',
+};
+
 export async function POST(req: Request) {
   try {
+    const key = req.headers.get('idempotency-key');
+    if (req.headers.get('idempotency-cancel')) {
+      // The client stopped this run for good, so no retry will come for its result
+      const run = key ? agentRuns.get(key) : undefined;
+      if (!run) {
+        return NextResponse.json({ error: 'Unknown idempotency key' }, { status: 404 });
+      }
+      run.abort.abort();
+      return NextResponse.json({ cancelled: true });
+    }
+    
     const { messages } = await req.json();
+    const wantsJson = (req.headers.get('accept') ?? '').includes('application/json');
+    
+    // A retry of a run we already know: hand back its result rather than running the agent again
+    const existing = key ? agentRuns.get(key) : undefined;
+    if (existing) {
+      if (!wantsJson) {
+        return new NextResponse(streamRun(existing, true), { headers: STREAM_HEADERS });
+      }
+      await Promise.race([
+        existing.finished,
+        new Promise((resolve) => setTimeout(resolve, RESULT_WAIT_MS)),
+      ]);
+      return NextResponse.json(runResult(existing));
+    }
+    if (req.headers.get('idempotency-resume') === 'only') {
+      // The client only wants to resume; the run is gone (restart or expiry), so don't start another
+      return NextResponse.json({ error: 'Unknown idempotency key' }, { status: key ? 404 : 409 });
+    }
     
     // Get the latest user message
     const latestMessage = messages[messages.length - 1].content;
@@ -42,50 +211,17 @@ export async function POST(req: Request) {
         throw new Error('Agent initialization failed');
       }
       
-      // Create a ReadableStream to stream the response
-      const stream = new ReadableStream({
-        async start(controller) {
-          try {
-            // Call the agent with the user message
-            const responseStream = await agent.stream(
-              { messages: [new HumanMessage(latestMessage)] },
-              config
-            );
-            
-            // Process each chunk from the agent response
-            for await (const responseChunk of responseStream) {
-              let content = '';
-              
-              if ("agent" in responseChunk) {
-                content = responseChunk.agent.messages[0].content;
-              } 
-              // else if ("tools" in responseChunk) {
-              //   content = responseChunk.tools.messages[0].content;
-              // }
-              if (content) {
-                const encoder = new TextEncoder();
-                const chunk = encoder.encode(JSON.stringify({
-                  type: 'text',
-                  text: content
-                }) + '\n');
-                controller.enqueue(chunk);
-              }
-            }
-            controller.close();
-          } catch (error) {
-            console.error('Error in stream:', error);
-            controller.error(error);
-          }
+      const run = startRun(agent, config, latestMessage, key);
+      if (wantsJson) {
+        if (!key) {
+          // Nobody else can fetch an unkeyed result, so stop the agent when this client leaves
+          req.signal.addEventListener('abort', () => run.abort.abort());
         }
-      });
+        await run.finished;
+        return NextResponse.json(runResult(run));
+      }
       
-      return new NextResponse(stream, {
-        headers: {
-          'Content-Type': 'text/event-stream',
-          'Cache-Control': 'no-cache',
-          'Connection': 'keep-alive',
-        },
-      });
+      return new NextResponse(streamRun(run, key !== null), { headers: STREAM_HEADERS });
     } catch (error) {
       console.error('Agent error:', error);
       
@@ -2,18 +2,34 @@
 title: Cambrian Agent Pipe Function
 author: Seiling Buidlbox
 author_url: https://www.github.com/0xn1c0/seiling-buildbox
-version: 0.1.0
+version: 0.8.3
 
 This module defines a Pipe class that utilizes Cambrian Agent for DeFi operations on Sei Network
 """
 
+import asyncio
+import codecs
 import json
+import logging
 import time
-from typing import Optional, Callable, Awaitable
+import uuid
+from contextlib import aclosing
+from contextvars import ContextVar
+from typing import AsyncGenerator, Optional, Callable, Awaitable
 
-import requests
+import aiohttp
 from pydantic import BaseModel, Field
 
+try:
+    import orjson
+except ImportError:  # orjson is optional; the standard json module parses lines without it
+    orjson = None
+
+# Both backends raise a ValueError subclass on malformed input
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+logger = logging.getLogger(__name__)
+
 
 def extract_event_info(event_emitter) -> tuple[Optional[str], Optional[str]]:
     """Extract chat ID and message ID from event emitter closure."""
@@ -27,6 +43,169 @@ def extract_event_info(event_emitter) -> tuple[Optional[str], Optional[str]]:
     return None, None
 
 
+# One pooled keep-alive session per process, shared by every pipe instance
+_http_session: Optional[aiohttp.ClientSession] = None
+_http_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_http_session(limit: int, limit_per_host: int) -> aiohttp.ClientSession:
+    """Return the process-wide HTTP session, creating it on the running event loop."""
+    global _http_session, _http_session_loop
+    loop = asyncio.get_running_loop()
+    if _http_session is None or _http_session.closed or _http_session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit=limit, limit_per_host=limit_per_host, keepalive_timeout=30
+        )
+        _http_session = aiohttp.ClientSession(connector=connector)
+        _http_session_loop = loop
+    return _http_session
+
+
+# Coalesces the current request's streamed text and status updates
+_request_batcher: ContextVar[Optional["EventBatcher"]] = ContextVar("request_batcher", default=None)
+
+
+class StreamStalled(Exception):
+    """The agent's stream went quiet for too long or ran past its deadline."""
+
+
+class NDJSONDecoder:
+    """Incrementally split a byte stream into one JSON value per line.
+
+    Multi-byte characters and lines may be split across network reads.
+    At most max_bytes of input are accepted; after that the decoder is
+    marked truncated and ignores the rest. A single line longer than
+    max_line_length characters is dropped instead of buffered.
+    """
+
+    def __init__(self, max_bytes: int, max_line_length: int):
+        self.max_bytes = max_bytes
+        self.max_line_length = max_line_length
+        self.received = 0
+        self.truncated = False
+        self.dropped_lines = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._buffer = ""
+        self._skipping = False
+
+    def feed(self, data: bytes) -> list:
+        """Decode the next piece of the body and return the values of the lines it completes."""
+        if self.truncated:
+            return []
+        if self.received + len(data) > self.max_bytes:
+            data = data[: self.max_bytes - self.received]
+            self.truncated = True
+        self.received += len(data)
+        return self._split(self._decoder.decode(data))
+
+    def close(self) -> list:
+        """Flush the decoder at the end of the body; the last line needs no newline."""
+        values = self._split(self._decoder.decode(b"", final=True))
+        if not self._skipping and not self.truncated:
+            values.extend(self._parse(self._buffer))
+        self._buffer = ""
+        self._skipping = False
+        return values
+
+    def _split(self, text: str) -> list:
+        values = []
+        start = 0
+        while (end := text.find("\n", start)) != -1:
+            if self._skipping:
+                # The oversized line ends here
+                self._skipping = False
+            elif len(self._buffer) + end - start > self.max_line_length:
+                self.dropped_lines += 1
+            else:
+                values.extend(self._parse(self._buffer + text[start:end]))
+            self._buffer = ""
+            start = end + 1
+        if not self._skipping:
+            self._buffer += text[start:]
+            if len(self._buffer) > self.max_line_length:
+                self._buffer = ""
+                self._skipping = True
+                self.dropped_lines += 1
+        return values
+
+    @staticmethod
+    def _parse(line: str) -> list:
+        line = line.strip()
+        if not line:
+            return []
+        try:
+            return [_json_loads(line)]
+        except ValueError:
+            # Skip malformed JSON lines
+            return []
+
+
+class EventBatcher:
+    """Coalesces one request's streamed text and status updates.
+
+    Text is held for up to flush_window seconds, or until flush_bytes
+    characters have built up, then goes out as one piece. Status updates
+    are sent at most once per status_interval; a newer update replaces a
+    held one, which goes out with the next flush once the interval has
+    passed. Final statuses are sent immediately.
+    """
+
+    def __init__(
+        self,
+        event_emitter: Callable[[dict], Awaitable[None]],
+        flush_window: float,
+        flush_bytes: int,
+        status_interval: float,
+    ):
+        self.event_emitter = event_emitter
+        self.flush_window = flush_window
+        self.flush_bytes = flush_bytes
+        self.status_interval = status_interval
+        self._parts: list[str] = []
+        self._size = 0
+        self._held_since = 0.0
+        self._last_status = float("-inf")
+        self._held_status: Optional[dict] = None
+
+    def due_in(self) -> Optional[float]:
+        """Seconds until the held text is due, or None when nothing is held."""
+        if not self._parts:
+            return None
+        return max(0.0, self._held_since + self.flush_window - time.monotonic())
+
+    async def add(self, text: str) -> str:
+        """Hold streamed text; return everything held once it is due, otherwise an empty string."""
+        if text:
+            if not self._parts:
+                self._held_since = time.monotonic()
+            self._parts.append(text)
+            self._size += len(text)
+        if self._parts and (self._size >= self.flush_bytes or self.due_in() == 0):
+            return await self.flush()
+        return ""
+
+    async def flush(self) -> str:
+        """Return all held text, sending the held status update along when it is due."""
+        text = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        if self._held_status is not None and time.monotonic() - self._last_status >= self.status_interval:
+            await self._send(self._held_status)
+        return text
+
+    async def status(self, event: dict, done: bool):
+        if done or time.monotonic() - self._last_status >= self.status_interval:
+            await self._send(event)
+        else:
+            self._held_status = event
+
+    async def _send(self, event: dict):
+        self._held_status = None
+        self._last_status = time.monotonic()
+        if self.event_emitter:
+            await self.event_emitter(event)
+
+
 class Pipe:
     class Valves(BaseModel):
         cambrian_url: str = Field(
@@ -39,6 +218,14 @@ class Pipe:
         emit_interval: float = Field(
             default=2.0, description="Interval in seconds between status emissions"
         )
+        flush_window: float = Field(
+            default=0.05,
+            description="Seconds to collect streamed text before sending it to OpenWebUI as one piece (0 sends each chunk at once)"
+        )
+        flush_bytes: int = Field(
+            default=4096,
+            description="Send collected text early once this many characters are waiting"
+        )
         enable_status_indicator: bool = Field(
             default=True, description="Enable or disable status indicator emissions"
         )
@@ -48,6 +235,30 @@ class Pipe:
         read_timeout: float = Field(
             default=60.0, description="Read timeout in seconds for streaming responses"
         )
+        max_connections: int = Field(
+            default=100,
+            description="Size of the process-wide HTTP connection pool (applied when the pool is created)"
+        )
+        max_connections_per_host: int = Field(
+            default=20,
+            description="Maximum pooled connections to a single host (applied when the pool is created)"
+        )
+        max_response_bytes: int = Field(
+            default=5_000_000,
+            description="Stop reading a streamed response after this many bytes and keep what arrived"
+        )
+        idle_timeout: float = Field(
+            default=30.0,
+            description="Give up on a stream that sends nothing for this many seconds and keep the partial reply (0 disables)"
+        )
+        stream_deadline: float = Field(
+            default=180.0,
+            description="Maximum duration of a whole streamed response in seconds (0 disables)"
+        )
+        max_line_length: int = Field(
+            default=1_000_000,
+            description="Drop streamed NDJSON lines longer than this many characters instead of buffering them"
+        )
 
     def __init__(self):
         """Initialize the Cambrian Agent Pipe."""
@@ -55,7 +266,29 @@ class Pipe:
         self.id = "cambrian_pipe"
         self.name = "Cambrian Agent Pipe"
         self.valves = self.Valves()
-        self.last_emit_time = 0
+        self.metrics = {
+            "cancellations": 0,
+            "truncated_responses": 0,
+            "dropped_lines": 0,
+            "stalls": 0,
+            # Last tool the agent announced before each stall; "none" when it had not called one
+            "stalls_by_tool": {},
+        }
+        self._background_tasks = set()
+
+    async def _cancel_run(self, headers: dict):
+        """Ask the launcher to abort the run behind these headers' idempotency key"""
+        session = get_http_session(self.valves.max_connections, self.valves.max_connections_per_host)
+        try:
+            async with session.post(
+                self.valves.cambrian_url,
+                json={"messages": []},
+                headers={**headers, "Idempotency-Cancel": "1"},
+                timeout=aiohttp.ClientTimeout(total=self.valves.connection_timeout),
+            ):
+                pass
+        except Exception:
+            pass  # Best effort; the launcher drops the run's result after its TTL anyway
 
     async def emit_status(
         self,
@@ -65,26 +298,96 @@ class Pipe:
         done: bool,
     ):
         """Emit status updates to the event emitter."""
-        current_time = time.time()
-        if (
-            __event_emitter__
-            and self.valves.enable_status_indicator
-            and (
-                current_time - self.last_emit_time >= self.valves.emit_interval or done
-            )
-        ):
-            await __event_emitter__(
-                {
-                    "type": "status",
-                    "data": {
-                        "status": "complete" if done else "in_progress",
-                        "level": level,
-                        "description": message,
-                        "done": done,
-                    },
-                }
-            )
-            self.last_emit_time = current_time
+        if not (__event_emitter__ and self.valves.enable_status_indicator):
+            return
+        event = {
+            "type": "status",
+            "data": {
+                "status": "complete" if done else "in_progress",
+                "level": level,
+                "description": message,
+                "done": done,
+            },
+        }
+        batcher = _request_batcher.get()
+        if batcher is not None and batcher.event_emitter is __event_emitter__:
+            # Throttled per request, so concurrent chats do not swallow each other's updates
+            await batcher.status(event, done)
+        else:
+            await __event_emitter__(event)
+
+    def _clean_response(self, response_text: str) -> str:
+        """Tidy the agent's full reply for the chat history."""
+        if not response_text.strip():
+            return "The agent processed your request but returned no response."
+        # Preserve line breaks but clean up extra spaces
+        lines = response_text.split('\n')
+        cleaned_lines = [line.strip() for line in lines if line.strip()]
+        response_text = '\n'.join(cleaned_lines)
+        
+        # Handle common formatting issues
+        response_text = response_text.replace('\\n', '\n')  # Handle escaped newlines
+        response_text = response_text.replace('  ', ' ')    # Remove double spaces
+        
+        # Ensure proper sentence formatting for the last line
+        if response_text and not response_text.endswith(('.', '!', '?', ')', '∞', ':')):
+            response_text += '.'
+        return response_text
+
+    @staticmethod
+    def _chunk_text(text: str, first: bool) -> str:
+        """Prepare one streamed text chunk for display."""
+        text = text.replace('\\n', '\n')  # Handle escaped newlines
+        # Leading whitespace would show up as an empty first line
+        return text.lstrip() if first else text
+
+    async def _read_ndjson(
+        self, response: aiohttp.ClientResponse, decoder: NDJSONDecoder, batcher: EventBatcher
+    ) -> AsyncGenerator[list, None]:
+        """Yield the JSON objects of a streamed NDJSON response, one list per network read.
+
+        An empty list means text held by the batcher came due while the
+        stream was quiet. Raises StreamStalled when no data arrives within
+        idle_timeout or the whole stream outlasts stream_deadline.
+        """
+        idle_timeout = self.valves.idle_timeout if self.valves.idle_timeout > 0 else None
+        deadline = (
+            time.monotonic() + self.valves.stream_deadline if self.valves.stream_deadline > 0 else None
+        )
+        last_data = time.monotonic()
+        try:
+            while True:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    raise StreamStalled(f"stream ran past its {self.valves.stream_deadline:g}s deadline")
+                limits = [batcher.due_in()]
+                if idle_timeout is not None:
+                    limits.append(last_data + idle_timeout - now)
+                if deadline is not None:
+                    limits.append(deadline - now)
+                timeout = min((limit for limit in limits if limit is not None), default=None)
+                try:
+                    data = await asyncio.wait_for(response.content.readany(), timeout)
+                except asyncio.TimeoutError:
+                    now = time.monotonic()
+                    if deadline is not None and now >= deadline:
+                        raise StreamStalled(
+                            f"stream ran past its {self.valves.stream_deadline:g}s deadline"
+                        )
+                    if idle_timeout is not None and now - last_data >= idle_timeout:
+                        raise StreamStalled(f"no data for {self.valves.idle_timeout:g}s")
+                    # Only the held text is due; keep waiting on the stream afterwards
+                    yield []
+                    continue
+                if not data:
+                    break
+                last_data = time.monotonic()
+                yield [value for value in decoder.feed(data) if isinstance(value, dict)]
+                if decoder.truncated:
+                    return
+            yield [value for value in decoder.close() if isinstance(value, dict)]
+        finally:
+            self.metrics["dropped_lines"] += decoder.dropped_lines
 
     async def pipe(
         self,
@@ -92,22 +395,30 @@ class Pipe:
         __user__: Optional[dict] = None,
         __event_emitter__: Callable[[dict], Awaitable[None]] = None,
         __event_call__: Callable[[dict], Awaitable[dict]] = None,
-    ) -> Optional[dict]:
-        """Process the pipe request with Cambrian Agent."""
+    ) -> AsyncGenerator[str, None]:
+        """Process the pipe request with Cambrian Agent, yielding text as it streams in."""
+        batcher = EventBatcher(
+            __event_emitter__, self.valves.flush_window, self.valves.flush_bytes, self.valves.emit_interval
+        )
+        _request_batcher.set(batcher)
         await self.emit_status(
             __event_emitter__, "info", "Calling Cambrian Agent...", False
         )
-        chat_id, _ = extract_event_info(__event_emitter__)
+        chat_id, message_id = extract_event_info(__event_emitter__)
         messages = body.get("messages", [])
 
         # Verify a message is available
         if messages:
             user_content = messages[-1]["content"]
+            headers = {
+                "Content-Type": "application/json",
+                # Lets a retry of this turn fetch the run's result instead of starting it again
+                "Idempotency-Key": (
+                    f"{chat_id}:{message_id}" if chat_id and message_id else uuid.uuid4().hex
+                ),
+            }
             try:
                 # Invoke Cambrian agent with the expected message format
-                headers = {
-                    "Content-Type": "application/json",
-                }
                 payload = {
                     "messages": [
                         {
@@ -117,30 +428,50 @@ class Pipe:
                     ]
                 }
                 
-                response = requests.post(
+                session = get_http_session(
+                    self.valves.max_connections, self.valves.max_connections_per_host
+                )
+                
+                async with session.post(
                     self.valves.cambrian_url, 
                     json=payload, 
                     headers=headers, 
-                    timeout=(self.valves.connection_timeout, self.valves.read_timeout),
-                    stream=True
-                )
-                
-                if response.status_code == 200:
+                    timeout=aiohttp.ClientTimeout(
+                        sock_connect=self.valves.connection_timeout,
+                        sock_read=self.valves.read_timeout,
+                    ),
+                ) as response:
+                    if response.status != 200:
+                        raise aiohttp.ClientError(
+                            f"Error: {response.status} - {await response.text()}"
+                        )
+                    
                     # Handle streaming response from Cambrian Agent
                     response_text = ""
                     collected_chunks = []
+                    # Text chunks received, including blank ones; indexes the launcher's chunk list
+                    received_chunks = 0
+                    last_tool = None
                     
                     try:
-                        # Set a chunk timeout to avoid hanging on individual chunks
-                        chunk_timeout = 5.0  # 5 seconds per chunk
-                        
-                        for line in response.iter_lines(decode_unicode=True, chunk_size=8192):
-                            if line.strip():
-                                try:
-                                    # Parse each JSON chunk from the stream
-                                    chunk_data = json.loads(line)
-                                    if chunk_data.get('type') == 'text' and chunk_data.get('text'):
-                                        collected_chunks.append(chunk_data['text'])
+                        decoder = NDJSONDecoder(
+                            self.valves.max_response_bytes, self.valves.max_line_length
+                        )
+                        async with aclosing(self._read_ndjson(response, decoder, batcher)) as reads:
+                            async for batch in reads:
+                                for chunk_data in batch:
+                                    if chunk_data.get('type') == 'tool':
+                                        last_tool = chunk_data.get('name') or last_tool
+                                    elif chunk_data.get('type') == 'text' and chunk_data.get('text'):
+                                        received_chunks += 1
+                                        text = self._chunk_text(chunk_data['text'], not collected_chunks)
+                                        if not text:
+                                            continue
+                                        collected_chunks.append(text)
+                                        # Hand the text to OpenWebUI in coalesced pieces as it is parsed
+                                        held = await batcher.add(text)
+                                        if held:
+                                            yield held
                                         
                                         # Emit status update for longer responses
                                         if len(collected_chunks) % 5 == 0:  # Every 5 chunks
@@ -150,14 +481,61 @@ class Pipe:
                                                 f"Processing response... ({len(collected_chunks)} chunks)", 
                                                 False
                                             )
-                                except json.JSONDecodeError:
-                                    # Skip malformed JSON lines
-                                    continue
+                                held = await batcher.add("")
+                                if held:
+                                    yield held
+                        held = await batcher.flush()
+                        if held:
+                            yield held
+                        
+                        if decoder.truncated:
+                            # Keep what arrived and stop the agent's stream here
+                            response.close()
+                            self.metrics["truncated_responses"] += 1
+                            await self.emit_status(
+                                __event_emitter__,
+                                "warning",
+                                f"Response exceeded {self.valves.max_response_bytes} bytes and was cut short",
+                                False,
+                            )
                         
                         # Join all chunks to form the complete response
                         if collected_chunks:
                             response_text = ''.join(collected_chunks).strip()
+                        else:
+                            yield self._clean_response(response_text)
                         
+                    except (asyncio.CancelledError, GeneratorExit):
+                        # Abort the stream now rather than letting the connection drain
+                        response.close()
+                        raise
+                    except StreamStalled as stall:
+                        # Keep what the agent already said instead of running it again
+                        response.close()
+                        held = await batcher.flush()
+                        if held:
+                            yield held
+                        tool = last_tool or "none"
+                        self.metrics["stalls"] += 1
+                        self.metrics["stalls_by_tool"][tool] = self.metrics["stalls_by_tool"].get(tool, 0) + 1
+                        logger.warning(
+                            "Cambrian Agent stream stalled (%s); last tool: %s; %d chunks received",
+                            stall,
+                            tool,
+                            received_chunks,
+                        )
+                        await self.emit_status(
+                            __event_emitter__,
+                            "warning",
+                            f"Cambrian Agent stalled ({stall}); returning the partial response",
+                            False,
+                        )
+                        response_text = ''.join(collected_chunks).strip()
+                        if not collected_chunks:
+                            response_text = f"The agent stopped responding ({stall})"
+                            if last_tool:
+                                response_text += f" while running {last_tool}"
+                            yield response_text
                     except Exception as stream_error:
                         await self.emit_status(
                             __event_emitter__, 
@@ -166,67 +544,94 @@ class Pipe:
                             False
                         )
                         
-                        # If streaming fails, try a non-streaming request
+                        # Close the streaming response first
+                        response.close()
+                        held = await batcher.flush()
+                        if held:
+                            yield held
+                        
+                        # Fetch the rest of the same run by its idempotency key rather than running it again
+                        fallback_text = None
                         try:
-                            # Close the streaming response first
-                            response.close()
-                            
-                            # Make a new non-streaming request
-                            fallback_response = requests.post(
+                            async with session.post(
                                 self.valves.cambrian_url, 
                                 json=payload, 
-                                headers=headers, 
-                                timeout=(self.valves.connection_timeout, 30),  # Shorter timeout for non-streaming
-                                stream=False
-                            )
-                            
-                            if fallback_response.status_code == 200:
-                                fallback_response.encoding = 'utf-8'
-                                cambrian_response = fallback_response.json()
-                                if isinstance(cambrian_response, dict):
-                                    response_text = cambrian_response.get('text', 
-                                        cambrian_response.get(self.valves.response_field, str(cambrian_response)))
+                                # Resume only: a launcher that lost the run answers 404/409 instead of starting it again
+                                headers={**headers, "Accept": "application/json", "Idempotency-Resume": "only"}, 
+                                timeout=aiohttp.ClientTimeout(
+                                    sock_connect=self.valves.connection_timeout,
+                                    total=30,  # Shorter timeout for non-streaming
+                                ),
+                            ) as fallback_response:
+                                if fallback_response.status == 200:
+                                    cambrian_response = _json_loads(
+                                        await fallback_response.text(encoding='utf-8')
+                                    )
+                                    if isinstance(cambrian_response, dict) and isinstance(
+                                        cambrian_response.get('chunks'), list
+                                    ):
+                                        # Carry on after the chunks that already reached the user
+                                        for text in cambrian_response['chunks'][received_chunks:]:
+                                            text = self._chunk_text(str(text), not collected_chunks)
+                                            if text:
+                                                collected_chunks.append(text)
+                                                yield text
+                                        response_text = ''.join(collected_chunks).strip()
+                                        if not response_text and cambrian_response.get('error'):
+                                            fallback_text = f"Agent error: {cambrian_response['error']}"
+                                        elif not response_text:
+                                            yield self._clean_response(response_text)
+                                        elif not cambrian_response.get('done', True):
+                                            await self.emit_status(
+                                                __event_emitter__,
+                                                "warning",
+                                                "Cambrian Agent is still running; returning the partial response",
+                                                False,
+                                            )
+                                    elif isinstance(cambrian_response, dict):
+                                        fallback_text = cambrian_response.get('text', 
+                                            cambrian_response.get(self.valves.response_field, str(cambrian_response)))
+                                    else:
+                                        fallback_text = str(cambrian_response)
+                                elif fallback_response.status in (404, 409):
+                                    # The run is gone; keep what already streamed rather than running the agent twice
+                                    response_text = ''.join(collected_chunks).strip()
+                                    if not response_text:
+                                        fallback_text = "Cambrian Agent lost the run before replying; please try again"
+                                    else:
+                                        await self.emit_status(
+                                            __event_emitter__,
+                                            "warning",
+                                            "Cambrian Agent lost the run; returning the partial response",
+                                            False,
+                                        )
                                 else:
-                                    response_text = str(cambrian_response)
-                            else:
-                                response_text = f"Fallback request failed: {fallback_response.status_code}"
+                                    fallback_text = f"Fallback request failed: {fallback_response.status}"
                         except Exception as fallback_error:
-                            response_text = f"Streaming error: {str(stream_error)[:100]}... Fallback error: {str(fallback_error)[:100]}"
-                    
-                    # Clean up and format the response
-                    if response_text.strip():
-                        # Preserve line breaks but clean up extra spaces
-                        lines = response_text.split('\n')
-                        cleaned_lines = [line.strip() for line in lines if line.strip()]
-                        response_text = '\n'.join(cleaned_lines)
-                        
-                        # Handle common formatting issues
-                        response_text = response_text.replace('\\n', '\n')  # Handle escaped newlines
-                        response_text = response_text.replace('  ', ' ')    # Remove double spaces
-                        
-                        # Ensure proper sentence formatting for the last line
-                        if response_text and not response_text.endswith(('.', '!', '?', ')', '∞', ':')):
-                            response_text += '.'
-                    else:
-                        response_text = "The agent processed your request but returned no response."
-                else:
-                    raise requests.exceptions.RequestException(
-                        f"Error: {response.status_code} - {response.text}"
-                    )
-
+                            fallback_text = f"Streaming error: {str(stream_error)[:100]}... Fallback error: {str(fallback_error)[:100]}"
+                        if fallback_text is not None:
+                            # Whatever already streamed stays on screen; start the fallback on a new paragraph
+                            separator = "\n\n" if collected_chunks else ""
+                            response_text = ''.join(collected_chunks).strip() + separator + fallback_text
+                            yield separator + self._clean_response(fallback_text)
+                
                 # Set assistant message with chain reply
-                body["messages"].append({"role": "assistant", "content": response_text})
+                body["messages"].append(
+                    {"role": "assistant", "content": self._clean_response(response_text)}
+                )
                 
                 await self.emit_status(__event_emitter__, "info", "Complete", True)
-                return response_text
-            except (requests.exceptions.RequestException, Exception) as e:
-                await self.emit_status(
-                    __event_emitter__,
-                    "error",
-                    f"Error during Cambrian execution: {str(e)}",
-                    True,
-                )
-                return {"error": str(e)}
+            except (asyncio.CancelledError, GeneratorExit):
+                # The user stopped generation; stop the agent too, since no retry will resume its run
+                self.metrics["cancellations"] += 1
+                task = asyncio.ensure_future(self._cancel_run(headers))
+                self._background_tasks.add(task)
+                task.add_done_callback(self._background_tasks.discard)
+                raise
+            except (aiohttp.ClientError, Exception) as e:
+                error_msg = f"Error during Cambrian execution: {str(e)}"
+                await self.emit_status(__event_emitter__, "error", error_msg, True)
+                yield error_msg
         # If no message is available, alert user
         else:
             await self.emit_status(
@@ -241,4 +646,4 @@ class Pipe:
                     "content": "No messages found in the request body",
                 }
             )
-            return {"error": "No messages found in the request body"}
\ No newline at end of file
+            yield "No messages found in the request body"
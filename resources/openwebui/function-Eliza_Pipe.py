@@ -2,17 +2,51 @@
 title: Eliza Agent Pipe (N8N Pattern)
 author: Seiling Buidlbox
 author_url: https://www.github.com/0xn1c0/seiling-buildbox
-version: 2.1.0
+version: 2.22.8
 
 This module defines a Pipe class that follows the exact working N8N workflow pattern
 """
 
-from typing import Optional, Callable, Awaitable
+from typing import Any, AsyncGenerator, Optional, Callable, Awaitable
 from pydantic import BaseModel, Field
+from collections import OrderedDict, deque
+from contextlib import aclosing
+from contextvars import ContextVar
+from datetime import datetime
+import asyncio
+import aiohttp
+import hashlib
 import os
 import time
-import requests
 import json
+import logging
+import re
+import sqlite3
+
+try:
+    import socketio
+except ImportError:  # python-socketio is optional; replies are polled without it
+    socketio = None
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # redis is optional; only needed for the redis state backend
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+# Eliza instance the current request was routed to; work it starts in the background inherits it
+_current_eliza_url: ContextVar[Optional[str]] = ContextVar("eliza_url", default=None)
+
+# Monotonic time by which the current request has to finish, when it has a deadline
+_request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+# Coalesces the current request's streamed text and status updates
+_request_batcher: ContextVar[Optional["EventBatcher"]] = ContextVar("request_batcher", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request used up its end-to-end time budget"""
 
 
 def extract_event_info(event_emitter) -> tuple[Optional[str], Optional[str]]:
@@ -26,25 +60,689 @@ def extract_event_info(event_emitter) -> tuple[Optional[str], Optional[str]]:
     return None, None
 
 
+# One pooled keep-alive session per process, shared by every pipe instance
+_http_session: Optional[aiohttp.ClientSession] = None
+_http_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_http_session(limit: int, limit_per_host: int) -> aiohttp.ClientSession:
+    """Return the process-wide HTTP session, creating it on the running event loop"""
+    global _http_session, _http_session_loop
+    loop = asyncio.get_running_loop()
+    if _http_session is None or _http_session.closed or _http_session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit=limit, limit_per_host=limit_per_host, keepalive_timeout=30
+        )
+        _http_session = aiohttp.ClientSession(connector=connector)
+        _http_session_loop = loop
+    return _http_session
+
+
+class ElizaSocket:
+    """Shared Socket.IO connection that receives messages pushed by an Eliza server"""
+
+    # Eliza's SOCKET_MESSAGE_TYPE.ROOM_JOINING
+    ROOM_JOINING = "1"
+
+    def __init__(self, url: str):
+        self.url = url
+        self._client = None
+        self._lock = asyncio.Lock()
+        self._subscriptions: dict[str, set] = {}
+        self._joined: dict[str, Optional[str]] = {}
+
+    @property
+    def connected(self) -> bool:
+        return self._client is not None and self._client.connected
+
+    async def connect(self, timeout: float):
+        async with self._lock:
+            if self.connected:
+                return
+            client = socketio.AsyncClient(reconnection=True, logger=False)
+            client.on("connect", self._on_connect)
+            client.on("messageBroadcast", self._on_broadcast)
+            await client.connect(self.url, transports=["websocket"], wait_timeout=timeout)
+            self._client = client
+
+    async def subscribe(
+        self, channel_id: str, server_id: Optional[str], timeout: float
+    ) -> "ChannelSubscription":
+        """Join the channel's room and return a subscription receiving its messages"""
+        await self.connect(timeout)
+        subscription = ChannelSubscription(self, channel_id)
+        self._subscriptions.setdefault(channel_id, set()).add(subscription)
+        if channel_id not in self._joined:
+            self._joined[channel_id] = server_id
+            await self._join(channel_id, server_id)
+        return subscription
+
+    def unsubscribe(self, subscription: "ChannelSubscription"):
+        subscriptions = self._subscriptions.get(subscription.channel_id)
+        if subscriptions:
+            subscriptions.discard(subscription)
+
+    def forget(self, channel_id: str):
+        """Stop rejoining a retired channel's room after reconnects"""
+        self._joined.pop(channel_id, None)
+        self._subscriptions.pop(channel_id, None)
+
+    async def _join(self, channel_id: str, server_id: Optional[str]):
+        await self._client.emit(
+            self.ROOM_JOINING,
+            {"channelId": channel_id, "roomId": channel_id, "serverId": server_id},
+        )
+
+    async def _on_connect(self):
+        # Rooms are per connection, so rejoin them after a reconnect
+        if self._client is None:
+            return
+        for channel_id, server_id in list(self._joined.items()):
+            await self._join(channel_id, server_id)
+
+    async def _on_broadcast(self, data: dict):
+        if not isinstance(data, dict):
+            return
+        channel_id = data.get("channelId") or data.get("roomId")
+        for subscription in list(self._subscriptions.get(channel_id, ())):
+            subscription.queue.put_nowait(
+                {
+                    "id": data.get("id"),
+                    "authorId": data.get("senderId"),
+                    "content": data.get("text") or "",
+                    "sourceType": data.get("source"),
+                    "created_at": data.get("createdAt"),
+                }
+            )
+
+
+class ChannelSubscription:
+    """Messages pushed to one channel while a request is waiting for its reply"""
+
+    def __init__(self, socket: ElizaSocket, channel_id: str):
+        self.socket = socket
+        self.channel_id = channel_id
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    @property
+    def connected(self) -> bool:
+        return self.socket.connected
+
+    async def get_batch(self, timeout: float) -> list:
+        """Wait up to timeout for a pushed message and return everything queued"""
+        batch = []
+        try:
+            batch.append(await asyncio.wait_for(self.queue.get(), timeout=max(timeout, 0)))
+        except asyncio.TimeoutError:
+            return batch
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    def close(self):
+        self.socket.unsubscribe(self)
+
+
+# One socket per Eliza server, shared by every pipe instance in the process
+_eliza_sockets: dict[str, ElizaSocket] = {}
+
+class ChannelCache:
+    """Bounded LRU map from (Eliza URL, chat id) pairs to Eliza channel ids.
+    
+    Entries also expire after sitting unused for the TTL. Evicted entries are
+    collected so the pipe can retire their channels off the request path.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[tuple[str, str], tuple[str, float]] = OrderedDict()
+        self._evicted: list[tuple[tuple[str, str], str]] = []
+
+    def configure(self, maxsize: int, ttl: float):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self._evict()
+
+    def get(self, key: tuple[str, str]) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        channel_id, last_used = entry
+        if time.monotonic() - last_used > self.ttl:
+            del self._entries[key]
+            self._evicted.append((key, channel_id))
+            return None
+        self._entries[key] = (channel_id, time.monotonic())
+        self._entries.move_to_end(key)
+        return channel_id
+
+    def put(self, key: tuple[str, str], channel_id: str):
+        self._entries[key] = (channel_id, time.monotonic())
+        self._entries.move_to_end(key)
+        self._evict()
+
+    def discard(self, key: tuple[str, str]):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def take_evicted(self) -> list[tuple[tuple[str, str], str]]:
+        evicted, self._evicted = self._evicted, []
+        return evicted
+
+    def _evict(self):
+        now = time.monotonic()
+        for key, (channel_id, last_used) in list(self._entries.items()):
+            if now - last_used <= self.ttl:
+                break  # Entries are ordered by last use, so the rest are fresh
+            del self._entries[key]
+            self._evicted.append((key, channel_id))
+        while len(self._entries) > self.maxsize:
+            key, (channel_id, _) = self._entries.popitem(last=False)
+            self._evicted.append((key, channel_id))
+
+
+class DiscoveryCache:
+    """Discovered server id and agent directory per Eliza URL, remembered with the time they were fetched"""
+
+    def __init__(self):
+        self._entries: dict[str, tuple[Any, float]] = {}
+
+    def get(self, key: str) -> tuple[Optional[Any], float]:
+        """Return the cached value and its age in seconds (infinite when missing)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, float("inf")
+        value, fetched_at = entry
+        return value, time.monotonic() - fetched_at
+
+    def put(self, key: str, value: Any, age: float = 0.0):
+        self._entries[key] = (value, time.monotonic() - age)
+
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
+
+
+class MessageRecord:
+    """What the pipe has learned about one channel message.
+    
+    The timestamp and reply link are read from the message once, and the
+    classification and parsed text are filled in the first time they are
+    needed, so a message is never parsed or delivered twice.
+    """
+
+    __slots__ = (
+        "id", "created_at", "reply_to", "fetched", "message", "looks_like_reply", "text", "delivered"
+    )
+
+    def __init__(self, msg_id: Optional[str], created_at: Optional[float], reply_to: Optional[str]):
+        self.id = msg_id
+        self.created_at = created_at
+        self.reply_to = reply_to
+        # Whether the REST API returned it; pushed copies lack the reply link
+        self.fetched = False
+        # The raw message, kept only while it waits to be claimed by a turn
+        self.message: Optional[dict] = None
+        self.looks_like_reply: Optional[bool] = None
+        self.text: Optional[str] = None
+        self.delivered = False
+
+
+class EventBatcher:
+    """Coalesces one request's streamed text and status updates.
+
+    Text is held for up to flush_window seconds, or until flush_bytes
+    characters have built up, then goes out as one piece. Status updates
+    are sent at most once per status_interval; a newer update replaces a
+    held one, which goes out with the next flush once the interval has
+    passed. Final statuses are sent immediately.
+    """
+
+    def __init__(
+        self,
+        event_emitter: Callable[[dict], Awaitable[None]],
+        flush_window: float,
+        flush_bytes: int,
+        status_interval: float,
+    ):
+        self.event_emitter = event_emitter
+        self.flush_window = flush_window
+        self.flush_bytes = flush_bytes
+        self.status_interval = status_interval
+        self._parts: list[str] = []
+        self._size = 0
+        self._held_since = 0.0
+        self._last_status = float("-inf")
+        self._held_status: Optional[dict] = None
+
+    def due_in(self) -> Optional[float]:
+        """Seconds until the held text is due, or None when nothing is held"""
+        if not self._parts:
+            return None
+        return max(0.0, self._held_since + self.flush_window - time.monotonic())
+
+    async def add(self, text: str) -> str:
+        """Hold streamed text; return everything held once it is due, otherwise an empty string"""
+        if text:
+            if not self._parts:
+                self._held_since = time.monotonic()
+            self._parts.append(text)
+            self._size += len(text)
+        if self._parts and (self._size >= self.flush_bytes or self.due_in() == 0):
+            return await self.flush()
+        return ""
+
+    async def flush(self) -> str:
+        """Return all held text, sending the held status update along when it is due"""
+        text = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        if self._held_status is not None and time.monotonic() - self._last_status >= self.status_interval:
+            await self._send(self._held_status)
+        return text
+
+    async def status(self, event: dict, done: bool):
+        if done or time.monotonic() - self._last_status >= self.status_interval:
+            await self._send(event)
+        else:
+            self._held_status = event
+
+    async def _send(self, event: dict):
+        self._held_status = None
+        self._last_status = time.monotonic()
+        if self.event_emitter:
+            await self.event_emitter(event)
+
+
+class AdmissionQueue:
+    """Caps how many turns talk to Eliza at once, admitting waiting users in turn.
+    
+    Waiting turns are queued per user and admitted round-robin across users,
+    so one user sending many messages cannot hold everyone else back.
+    """
+
+    # Shortest gap between position reports, even when status updates are unthrottled
+    MIN_REPORT_INTERVAL = 0.5
+
+    def __init__(self):
+        self.limit = 0
+        self._active = 0
+        self._waiting: OrderedDict[str, deque] = OrderedDict()
+
+    def configure(self, limit: int):
+        self.limit = limit
+        self._admit_next()
+
+    @property
+    def busy(self) -> bool:
+        """Whether a turn arriving now would have to wait"""
+        return self.limit > 0 and (self._active >= self.limit or bool(self._waiting))
+
+    def position(self, future: asyncio.Future) -> int:
+        """1-based place of a waiting turn in admission order"""
+        queues = list(self._waiting.values())
+        place = 0
+        for depth in range(max(map(len, queues), default=0)):
+            for queue in queues:
+                if depth < len(queue):
+                    place += 1
+                    if queue[depth] is future:
+                        return place
+        return place
+
+    async def acquire(
+        self,
+        user_key: str,
+        on_wait: Callable[[int], Awaitable[None]],
+        interval: float,
+        timeout: Callable[[float], float],
+    ):
+        """Wait for a slot, reporting the queue position every interval seconds (at least MIN_REPORT_INTERVAL).
+        
+        timeout caps each wait and raises once no time is left.
+        """
+        if not self.busy:
+            self._active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user_key, deque()).append(future)
+        try:
+            while not future.done():
+                await on_wait(self.position(future))
+                try:
+                    await asyncio.wait_for(
+                        asyncio.shield(future), timeout(max(interval, self.MIN_REPORT_INTERVAL))
+                    )
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if future.done():
+                self.release()  # Admitted just as we gave up; pass the slot on
+            else:
+                future.cancel()
+                queue = self._waiting.get(user_key)
+                if queue is not None and future in queue:
+                    queue.remove(future)
+                    if not queue:
+                        del self._waiting[user_key]
+            raise
+
+    def release(self):
+        self._active -= 1
+        self._admit_next()
+
+    def _admit_next(self):
+        while self._waiting and (self.limit <= 0 or self._active < self.limit):
+            user_key, queue = next(iter(self._waiting.items()))
+            future = queue.popleft()
+            if queue:
+                self._waiting.move_to_end(user_key)
+            else:
+                del self._waiting[user_key]
+            if future.done():
+                continue
+            self._active += 1
+            future.set_result(None)
+
+
+class RedisStateStore:
+    """Shared key/value state kept in Redis, visible to every OpenWebUI worker"""
+
+    def __init__(self, url: str):
+        if aioredis is None:
+            raise Exception("state_backend 'redis' requires the redis package")
+        self._client = aioredis.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._client.get(key)
+
+    async def set(self, key: str, value: str, ttl: float):
+        await self._client.set(key, value, ex=max(1, int(ttl)))
+
+    async def add(self, key: str, value: str, ttl: float) -> str:
+        """Store value only if key is absent, returning whichever value won"""
+        if await self._client.set(key, value, ex=max(1, int(ttl)), nx=True):
+            return value
+        existing = await self._client.get(key)
+        if existing is None:
+            # The winner expired in between; try once more
+            await self._client.set(key, value, ex=max(1, int(ttl)), nx=True)
+            existing = await self._client.get(key)
+        return existing if existing is not None else value
+
+    async def delete(self, key: str):
+        await self._client.delete(key)
+
+
+class SQLiteStateStore:
+    """Shared key/value state in a local SQLite file, for workers on one host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        if not self._ready:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS eliza_pipe_state "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._ready = True
+        return connection
+
+    def _execute(self, key: str, statement: Optional[str] = None, args: tuple = ()) -> Optional[str]:
+        """Run an optional write statement, then return the key's live value"""
+        connection = self._connect()
+        try:
+            if statement:
+                connection.execute(statement, args)
+            row = connection.execute(
+                "SELECT value FROM eliza_pipe_state WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+            return row[0] if row else None
+        finally:
+            connection.close()
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._execute, key)
+
+    async def set(self, key: str, value: str, ttl: float):
+        await asyncio.to_thread(
+            self._execute,
+            key,
+            "INSERT OR REPLACE INTO eliza_pipe_state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, time.time() + ttl),
+        )
+
+    async def add(self, key: str, value: str, ttl: float) -> str:
+        """Store value only if key is absent or expired, returning whichever value won"""
+        now = time.time()
+        existing = await asyncio.to_thread(
+            self._execute,
+            key,
+            "INSERT INTO eliza_pipe_state (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE eliza_pipe_state.expires_at <= ?",
+            (key, value, now + ttl, now),
+        )
+        return existing if existing is not None else value
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(
+            self._execute, key, "DELETE FROM eliza_pipe_state WHERE key = ?", (key,)
+        )
+
+# Content that typically starts or marks an agent reply when metadata is missing
+AGENT_REPLY_PATTERN = re.compile(
+    r"^(?:I'll|I will|Sure)|✅|Successfully|Transaction:|(?i:transferred)|^\{.*follow_ups",
+    re.DOTALL,
+)
+
+# System prompt markers; everything from the first one on is dropped
+SYSTEM_PROMPT_MARKERS = re.compile(
+    "|".join(
+        re.escape(marker)
+        for marker in (
+            '### task:', '### guidelines:', '### output:', '### chat history:',
+            '<chat_history>', 'json format:', 'response must be', 'suggest 3-5 relevant',
+        )
+    ),
+    re.IGNORECASE,
+)
+
+# Lines that look like leaked system instructions
+SYSTEM_INSTRUCTION_LINES = re.compile(
+    "|".join(
+        re.escape(instruction)
+        for instruction in (
+            'write all follow-up questions', 'make questions concise',
+            'only suggest follow-ups', 'use the conversation', 'default to english',
+        )
+    ),
+    re.IGNORECASE,
+)
+
+
 class Pipe:
+    # Message records remembered per channel
+    INDEX_SIZE = 512
+
+    # Longest carried-over message when a channel is rotated
+    CARRYOVER_CHARS = 500
+
+    # Message endpoints offered by different Eliza versions, in order of preference
+    MESSAGE_ENDPOINTS = (
+        "/api/messaging/central-channels/{channel_id}/messages",
+        "/api/messaging/channels/{channel_id}/messages",
+        "/api/agents/{agent_id}/messages",
+    )
+
     class Valves(BaseModel):
         eliza_url: str = Field(
             default="http://seiling-eliza:3000",
-            description="Base URL for Eliza API"
+            description="Base URL for Eliza API (comma-separate several URLs to spread chats across Eliza instances)"
+        )
+        agent_selector: str = Field(
+            default="",
+            description="Comma-separated agent names chats may be routed to (empty allows every agent)"
+        )
+        routing_strategy: str = Field(
+            default="hash",
+            description="How a new chat is placed on an agent: 'hash' (rendezvous hash of the chat id) or 'least_outstanding' (fewest requests in flight on this worker)"
+        )
+        manifold_mode: bool = Field(
+            default=False,
+            description="List every Eliza agent matching agent_selector as its own model instead of one routed model"
+        )
+        instance_retry_after: float = Field(
+            default=30.0,
+            description="Seconds an Eliza instance that stopped answering is left out of routing"
         )
-        wait_time: int = Field(
-            default=8,
-            description="Seconds to wait for agent response (N8N uses 10)"
+        response_timeout: float = Field(
+            default=120.0,
+            description="Maximum seconds to wait for the agent's reply before giving up"
+        )
+        poll_interval: float = Field(
+            default=0.5,
+            description="Initial delay in seconds between checks for new agent messages"
+        )
+        max_poll_interval: float = Field(
+            default=4.0,
+            description="Upper bound in seconds for the backed-off delay between checks"
+        )
+        poll_backoff: float = Field(
+            default=1.5,
+            description="Factor applied to the poll delay after each check without new messages"
+        )
+        quiescence_window: float = Field(
+            default=3.0,
+            description="Seconds without new agent messages before a multi-part reply is considered complete"
+        )
+        delivery_mode: str = Field(
+            default="auto",
+            description="How agent replies are received: 'socket' (pushed over Socket.IO), 'poll' (REST polling) or 'auto' (socket with polling fallback)"
+        )
+        message_page_size: int = Field(
+            default=20,
+            description="Messages requested per page when reading new channel messages"
+        )
+        max_message_pages: int = Field(
+            default=5,
+            description="Maximum pages read back per poll to catch up with the channel"
+        )
+        socket_connect_timeout: float = Field(
+            default=5.0,
+            description="Seconds to wait for the Eliza Socket.IO connection before falling back to polling"
         )
         emit_interval: float = Field(
             default=2.0, description="Interval in seconds between status emissions"
         )
+        flush_window: float = Field(
+            default=0.05,
+            description="Seconds to collect streamed reply text before sending it to OpenWebUI as one piece (0 sends each part at once)"
+        )
+        flush_bytes: int = Field(
+            default=4096,
+            description="Send collected reply text early once this many characters are waiting"
+        )
         enable_status_indicator: bool = Field(
             default=True, description="Enable or disable status indicator emissions"
         )
         channel_name: str = Field(
             default="openwebui_eliza_channel",
-            description="Name for the persistent channel"
+            description="Name for the persistent channel (used as the prefix for per-chat channels)"
+        )
+        per_chat_channels: bool = Field(
+            default=True,
+            description="Give each OpenWebUI chat its own Eliza channel instead of sharing one"
+        )
+        channel_cache_size: int = Field(
+            default=256,
+            description="Maximum number of chat to channel mappings kept in memory"
+        )
+        channel_pool_size: int = Field(
+            default=2,
+            description="Channels kept ready per agent, with the agent already added, for new chats to claim (0 disables)"
+        )
+        channel_ttl: float = Field(
+            default=3600.0,
+            description="Seconds a chat's channel mapping may sit unused before it is evicted"
+        )
+        discovery_ttl: float = Field(
+            default=300.0,
+            description="Seconds discovered server and agent ids are used before being refreshed in the background"
+        )
+        discovery_max_stale: float = Field(
+            default=3600.0,
+            description="Seconds stale discovery results may still be served while a refresh runs"
+        )
+        rotate_after_messages: int = Field(
+            default=500,
+            description="Start a fresh channel once this many messages went through the current one (0 disables)"
+        )
+        rotate_after_bytes: int = Field(
+            default=1_000_000,
+            description="Start a fresh channel once this many bytes of message content went through the current one (0 disables)"
+        )
+        rotate_after_seconds: float = Field(
+            default=86400.0,
+            description="Start a fresh channel once this worker has used the current one for this many seconds (0 disables)"
+        )
+        rotation_carryover_turns: int = Field(
+            default=3,
+            description="Recent conversation turns carried into a fresh channel when a chat is rotated or comes back after its channel was retired"
+        )
+        debug_report_messages: int = Field(
+            default=10,
+            description="How many of the most recent channel messages to include when no agent reply is found"
+        )
+        debug_to_log: bool = Field(
+            default=False,
+            description="Write the no-reply diagnostics to the server log as structured JSON instead of the chat"
+        )
+        state_backend: str = Field(
+            default="memory",
+            description="Where discovery results and chat channels are shared: 'memory' (this worker only), 'redis' or 'sqlite'"
+        )
+        redis_url: str = Field(
+            default="redis://:seiling123@seiling-redis:6379/0",
+            description="Redis URL used when state_backend is 'redis'"
+        )
+        sqlite_path: str = Field(
+            default="",
+            description="SQLite file used when state_backend is 'sqlite' (defaults to eliza_pipe_state.db in DATA_DIR)"
+        )
+        state_key_prefix: str = Field(
+            default="eliza_pipe",
+            description="Prefix for keys written to the shared state backend"
+        )
+        evicted_channel_action: str = Field(
+            default="archive",
+            description="What to do with the channel of an evicted chat: 'archive' (flag it in its metadata), 'delete' or 'keep'"
+        )
+        max_in_flight: int = Field(
+            default=16,
+            description="Turns this worker lets talk to Eliza at once; the rest wait in a queue fair across users (0 disables)"
+        )
+        request_deadline: float = Field(
+            default=180.0,
+            description="End-to-end seconds a chat turn may take across discovery, setup, sending and waiting (0 disables)"
+        )
+        request_timeout: float = Field(
+            default=10.0, description="Timeout in seconds for each Eliza API call"
+        )
+        max_connections: int = Field(
+            default=100,
+            description="Size of the process-wide HTTP connection pool (applied when the pool is created)"
+        )
+        max_connections_per_host: int = Field(
+            default=20,
+            description="Maximum pooled connections to a single host (applied when the pool is created)"
         )
 
     def __init__(self):
@@ -52,10 +750,80 @@ class Pipe:
         self.id = "eliza_pipe_n8n"
         self.name = "Eliza Agent Pipe (N8N Pattern)"
         self.valves = self.Valves()
-        self.last_emit_time = 0
-        self._cached_channel_id = None
-        self._cached_server_id = None
-        self._cached_agent_id = None
+        self._discovery = DiscoveryCache()
+        self._store = None
+        self._store_config = None
+        self._channels = ChannelCache()
+        # Chat id -> (Eliza URL, agent id) the chat was placed on
+        self._routes: OrderedDict[str, tuple[str, str]] = OrderedDict()
+        self._outstanding: dict[tuple[str, str], int] = {}
+        self._down_until: dict[str, float] = {}
+        self._cursors: dict[str, tuple[float, set]] = {}
+        # Messages, bytes and first-use time per channel, for rotation
+        self._channel_usage: dict[str, list] = {}
+        self._carryover: dict[str, str] = {}
+        # (Eliza URL, agent id) -> ready channels waiting to be claimed by a new chat
+        self._channel_pool: dict[tuple[str, str], list[str]] = {}
+        self._pool_adopted: set[tuple[str, str]] = set()
+        self._preferred_endpoints: dict[str, str] = {}
+        # Channel id -> message id -> record, oldest first
+        self._index: dict[str, OrderedDict[str, MessageRecord]] = {}
+        # Undelivered messages per channel, checked by every turn waiting on it
+        self._pending: dict[str, OrderedDict[Any, MessageRecord]] = {}
+        self._waiting_turns: dict[str, int] = {}
+        self.metrics = {
+            "endpoint_probes": 0,
+            "endpoint_failures": 0,
+            "discovery_refreshes": 0,
+            "invalidations": 0,
+            "rotations": 0,
+            "pool_hits": 0,
+            "pool_misses": 0,
+            "queued": 0,
+            "reroutes": 0,
+            "cancellations": 0,
+            "preferred_endpoints": {},
+        }
+        self._admission = AdmissionQueue()
+        self._background_tasks = set()
+        self._inflight: dict[tuple, asyncio.Future] = {}
+
+    @property
+    def pipes(self):
+        """Agent listing for OpenWebUI, present only in manifold mode.
+        
+        OpenWebUI treats any function with a `pipes` attribute as a manifold,
+        so outside manifold mode the attribute must not exist at all.
+        """
+        if not self.valves.manifold_mode:
+            raise AttributeError("pipes")
+        return self._list_agent_models
+
+    async def _list_agent_models(self) -> list[dict]:
+        """One model per agent, from the cached directories of every instance"""
+        try:
+            directories = await self._load_directories()
+        except Exception as e:
+            logger.warning("Eliza pipe could not list agents: %s", e)
+            return []
+        models = {}
+        for url, (server_id, agents) in directories.items():
+            for agent in self._matching_agents(agents):
+                if agent["id"] in models:
+                    continue  # The same agent served by several instances is one model
+                models[agent["id"]] = {"id": agent["id"], "name": agent["name"] or agent["id"]}
+                if not self.valves.per_chat_channels:
+                    self._spawn(self._prepare_agent_channel(url, server_id, agent["id"]))
+        return list(models.values())
+
+    async def _prepare_agent_channel(self, url: str, server_id: str, agent_id: str):
+        """Resolve an agent's shared channel ahead of its first request"""
+        _current_eliza_url.set(url)
+        if self._channels.get((url, agent_id)):
+            return
+        channel_id = await self._get_or_create_channel(self._channel_name(agent_id), server_id, agent_id)
+        self._remember_route(agent_id, (url, agent_id))
+        self._channels.put((url, agent_id), channel_id)
 
     async def emit_status(
         self,
@@ -64,103 +832,473 @@ class Pipe:
         message: str,
         done: bool,
     ):
-        current_time = time.time()
-        if (
-            __event_emitter__
-            and self.valves.enable_status_indicator
-            and (
-                current_time - self.last_emit_time >= self.valves.emit_interval or done
+        if not (__event_emitter__ and self.valves.enable_status_indicator):
+            return
+        event = {
+            "type": "status",
+            "data": {
+                "status": "complete" if done else "in_progress",
+                "level": level,
+                "description": message,
+                "done": done,
+            },
+        }
+        batcher = _request_batcher.get()
+        if batcher is not None and batcher.event_emitter is __event_emitter__:
+            # Throttled per request, so concurrent chats do not swallow each other's updates
+            await batcher.status(event, done)
+        else:
+            await __event_emitter__(event)
+
+    def _remaining(self, limit: float) -> float:
+        """Cap a step's timeout by what is left of the request deadline"""
+        deadline = _request_deadline.get()
+        if deadline is None:
+            return limit
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(
+                f"Eliza did not finish within the {self.valves.request_deadline:g}s request deadline"
             )
-        ):
-            await __event_emitter__(
-                {
-                    "type": "status",
-                    "data": {
-                        "status": "complete" if done else "in_progress",
-                        "level": level,
-                        "description": message,
-                        "done": done,
-                    },
-                }
+        return min(limit, remaining)
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        payload: Optional[dict] = None,
+        params: Optional[dict] = None,
+    ) -> tuple[int, Any]:
+        """Send a request over the shared session and return its status and decoded body"""
+        session = get_http_session(
+            self.valves.max_connections, self.valves.max_connections_per_host
+        )
+        timeout = self._remaining(self.valves.request_timeout)
+        try:
+            async with session.request(
+                method,
+                url,
+                json=payload,
+                params=params,
+                timeout=aiohttp.ClientTimeout(total=timeout),
+            ) as response:
+                text = await response.text()
+        except asyncio.TimeoutError:
+            self._remaining(0)  # Report a spent budget rather than a slow call
+            raise
+        try:
+            return response.status, json.loads(text)
+        except ValueError:
+            return response.status, text
+
+    def _get_store(self):
+        """Return the shared state backend selected by the valves, or None for memory only"""
+        backend = self.valves.state_backend.lower()
+        config = (backend, self.valves.redis_url, self.valves.sqlite_path)
+        if config != self._store_config:
+            self._store_config = config
+            if backend == "redis":
+                self._store = RedisStateStore(self.valves.redis_url)
+            elif backend == "sqlite":
+                path = self.valves.sqlite_path or os.path.join(
+                    os.environ.get("DATA_DIR", "."), "eliza_pipe_state.db"
+                )
+                self._store = SQLiteStateStore(path)
+            else:
+                self._store = None
+        return self._store
+
+    def _eliza_urls(self) -> list[str]:
+        return [url.strip().rstrip("/") for url in self.valves.eliza_url.split(",") if url.strip()]
+
+    @property
+    def _eliza_url(self) -> str:
+        """Eliza instance the current request was routed to"""
+        return _current_eliza_url.get() or self._eliza_urls()[0]
+
+    def _state_key(self, kind: str, name: str, url: Optional[str] = None) -> str:
+        return f"{self.valves.state_key_prefix}:{kind}:{url or self._eliza_url}:{name}"
+
+    async def _store_get(self, key: str) -> Optional[str]:
+        store = self._get_store()
+        if store is None:
+            return None
+        try:
+            return await store.get(key)
+        except Exception:
+            return None  # The shared store is an optimisation; fall back to local state
+
+    async def _store_set(self, key: str, value: str, ttl: float):
+        store = self._get_store()
+        if store is None:
+            return
+        try:
+            await store.set(key, value, ttl)
+        except Exception:
+            pass
+
+    async def _store_add(self, key: str, value: str, ttl: float) -> str:
+        store = self._get_store()
+        if store is None:
+            return value
+        try:
+            return await store.add(key, value, ttl)
+        except Exception:
+            return value
+
+    async def _store_delete(self, key: str):
+        store = self._get_store()
+        if store is None:
+            return
+        try:
+            await store.delete(key)
+        except Exception:
+            pass
+
+    def _channel_name(self, channel_key: str) -> str:
+        """Name of the Eliza channel used for a chat ('' for the shared channel)"""
+        if channel_key:
+            return f"{self.valves.channel_name}_{channel_key}"
+        return self.valves.channel_name
+
+    async def _single_flight(self, key: tuple, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Run factory once per key, letting concurrent callers await the same result"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            # Every waiter may have run out of time, so retrieve the exception here too
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        # Shield so one caller giving up does not cancel the setup for the others
+        deadline = _request_deadline.get()
+        if deadline is None:
+            return await asyncio.shield(task)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self._remaining(float("inf")))
+        except asyncio.TimeoutError:
+            self._remaining(0)
+            raise
+
+    async def _list_channels(self, server_id: str) -> list:
+        """List the server's channels, treating any failure as no channels"""
+        # Current Eliza lists channels per server; older builds served one flat list
+        for path in (f"central-servers/{server_id}/channels", "central-channels"):
+            try:
+                status, channels_data = await self._request(
+                    "GET", f"{self._eliza_url}/api/messaging/{path}"
+                )
+                if status == 200 and channels_data.get("success"):
+                    return channels_data.get("data", {}).get("channels") or []
+            except Exception:
+                pass  # Continue to create new channel if lookup fails
+        return []
+
+    async def _channel_has_agent(self, channel_id: str, agent_id: str) -> bool:
+        try:
+            status, channel_agents = await self._request(
+                "GET",
+                f"{self._eliza_url}/api/messaging/central-channels/{channel_id}/agents",
+            )
+            return status == 200 and bool(
+                channel_agents.get("success")
+                and any(agent.get("id") == agent_id for agent in channel_agents.get("data", {}).get("agents", []))
             )
-            self.last_emit_time = current_time
+        except Exception:
+            return False
 
-    def _get_or_create_channel(self) -> tuple[str, str, str]:
-        """Get existing channel or create a new one, caching the IDs"""
-        
-        # Step 1: Get Eliza Server
-        server_response = requests.get(
-            f"{self.valves.eliza_url}/api/messaging/central-servers",
-            timeout=10
+    async def _get_or_create_channel(
+        self, channel_name: str, server_id: str, agent_id: str, history: Optional[list] = None
+    ) -> str:
+        """Get existing channel or create a new one, sharing one setup between concurrent requests"""
+        return await self._single_flight(
+            ("channel", self._eliza_url, channel_name, agent_id),
+            lambda: self._setup_channel(channel_name, server_id, agent_id, history),
+        )
+
+    async def _discover(self) -> tuple[str, list]:
+        """Resolve the Eliza server id and agent directory, sharing one lookup between concurrent requests"""
+        return await self._single_flight(
+            ("discovery", self._eliza_url), self._lookup_directory
+        )
+
+    async def _lookup_directory(self) -> tuple[str, list]:
+        (status, server_data), (agents_status, agents_data) = await asyncio.gather(
+            self._request("GET", f"{self._eliza_url}/api/messaging/central-servers"),
+            self._request("GET", f"{self._eliza_url}/api/agents"),
         )
         
-        if server_response.status_code != 200:
-            raise Exception(f"Failed to get server info: {server_response.text}")
+        # Step 1: Get Eliza Server
+        if status != 200:
+            raise Exception(f"Failed to get server info: {server_data}")
         
-        server_data = server_response.json()
         if not server_data.get("success") or not server_data.get("data", {}).get("servers"):
             raise Exception("No servers found in Eliza")
         
         server_id = server_data["data"]["servers"][0]["id"]
         
         # Step 2: List Agents
-        agents_response = requests.get(
-            f"{self.valves.eliza_url}/api/agents",
-            timeout=10
-        )
-        
-        if agents_response.status_code != 200:
-            raise Exception(f"Failed to get agents: {agents_response.text}")
+        if agents_status != 200:
+            raise Exception(f"Failed to get agents: {agents_data}")
         
-        agents_data = agents_response.json()
         if not agents_data.get("success") or not agents_data.get("data", {}).get("agents"):
             raise Exception("No agents found in Eliza")
         
-        agent_id = agents_data["data"]["agents"][0]["id"]
+        agents = [
+            {
+                "id": agent["id"],
+                "name": agent.get("name") or agent.get("characterName") or "",
+                "active": agent.get("status", "active") == "active",
+            }
+            for agent in agents_data["data"]["agents"]
+        ]
+        # Stopped agents never answer, unless there is nothing else to talk to
+        return server_id, [agent for agent in agents if agent["active"]] or agents
+
+    async def _get_discovery(self) -> tuple[str, list]:
+        """Return the cached server id and agent directory, revalidating them in the background once stale"""
+        value, age = self._discovery.get(self._eliza_url)
+        if value is None:
+            # Another worker may already have discovered this deployment
+            stored = await self._store_get(self._state_key("discovery", "directory"))
+            if stored:
+                data = json.loads(stored)
+                value = (data["server_id"], data["agents"])
+                age = max(0.0, time.time() - data["fetched_at"])
+                self._discovery.put(self._eliza_url, value, age)
+        if value is not None and age < self.valves.discovery_ttl:
+            return value
+        if value is not None and age < self.valves.discovery_max_stale:
+            self._spawn(self._refresh_discovery())
+            return value
+        return await self._refresh_discovery()
+
+    async def _refresh_discovery(self) -> tuple[str, list]:
+        value = await self._discover()
+        self.metrics["discovery_refreshes"] += 1
+        previous, _ = self._discovery.get(self._eliza_url)
+        self._discovery.put(self._eliza_url, value)
+        await self._store_set(
+            self._state_key("discovery", "directory"),
+            json.dumps({"server_id": value[0], "agents": value[1], "fetched_at": time.time()}),
+            self.valves.discovery_max_stale,
+        )
+        if previous is not None and previous != value:
+            self._forget_departed_agents(self._eliza_url, previous, value)
+        return value
+
+    def _forget_departed_agents(self, url: str, previous: tuple[str, list], current: tuple[str, list]):
+        """Drop the placements of chats whose agent left this instance's directory.
         
-        # Step 3: Try to find existing channel first
-        try:
-            channels_response = requests.get(
-                f"{self.valves.eliza_url}/api/messaging/central-channels",
-                timeout=10
+        Chats on agents that are still listed keep their channels; the rest
+        are placed again on their next turn.
+        """
+        server_changed = previous[0] != current[0]
+        remaining = {agent["id"] for agent in current[1]}
+        for channel_key, (route_url, agent_id) in list(self._routes.items()):
+            if route_url == url and (server_changed or agent_id not in remaining):
+                self._routes.pop(channel_key, None)
+                self._channels.discard((url, channel_key))
+
+    def _matching_agents(self, agents: list) -> list:
+        """Agents allowed by agent_selector, matched by name"""
+        selector = {name.strip().lower() for name in self.valves.agent_selector.split(",") if name.strip()}
+        if not selector:
+            return agents
+        return [agent for agent in agents if agent["name"].lower() in selector]
+
+    async def _load_directories(self) -> dict[str, tuple[str, list]]:
+        """Fetch the directory of every healthy Eliza instance at once"""
+        now = time.monotonic()
+        urls = self._eliza_urls()
+        # When every instance is marked down, try them all rather than fail outright
+        healthy = [url for url in urls if self._down_until.get(url, 0) <= now] or urls
+        
+        async def directory(url: str) -> tuple[str, list]:
+            _current_eliza_url.set(url)  # Each gathered task has its own context
+            return await self._get_discovery()
+        
+        results = await asyncio.gather(*(directory(url) for url in healthy), return_exceptions=True)
+        directories = {}
+        for url, result in zip(healthy, results):
+            if isinstance(result, BaseException):
+                self._mark_down(url)
+                if len(healthy) == 1:
+                    raise result
+            else:
+                directories[url] = result
+        return directories
+
+    def _mark_down(self, url: str):
+        self._down_until[url] = time.monotonic() + self.valves.instance_retry_after
+
+    @staticmethod
+    def _rendezvous_score(chat_key: str, url: str, agent_id: str) -> int:
+        # hashlib rather than hash() so every worker computes the same placement
+        digest = hashlib.blake2b(f"{chat_key}|{url}|{agent_id}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    async def _route(self, channel_key: str, agent_id: Optional[str] = None) -> tuple[str, str, str]:
+        """Pick the Eliza instance, server and agent for a chat.
+        
+        A chat stays where its earlier turns went, since its history lives in
+        that agent's channel. New chats, and chats whose agent or instance is
+        no longer available, are placed by routing_strategy. A manifold model
+        names its agent, which only leaves the instance to choose.
+        """
+        directories = await self._load_directories()
+        candidates = [
+            (url, server_id, agent["id"])
+            for url, (server_id, agents) in directories.items()
+            for agent in (
+                self._matching_agents(agents) if agent_id is None
+                else [agent for agent in agents if agent["id"] == agent_id]
             )
-            
-            if channels_response.status_code == 200:
-                channels_data = channels_response.json()
-                if channels_data.get("success") and channels_data.get("data", {}).get("channels"):
-                    for channel in channels_data["data"]["channels"]:
-                        if channel.get("name") == self.valves.channel_name:
-                            # Check if agent is already in this channel
-                            channel_agents_response = requests.get(
-                                f"{self.valves.eliza_url}/api/messaging/central-channels/{channel['id']}/agents",
-                                timeout=10
-                            )
-                            if channel_agents_response.status_code == 200:
-                                channel_agents = channel_agents_response.json()
-                                if (channel_agents.get("success") and 
-                                    any(agent.get("id") == agent_id for agent in channel_agents.get("data", {}).get("agents", []))):
-                                    return channel['id'], server_id, agent_id
-        except Exception:
-            pass  # Continue to create new channel if lookup fails
+        ]
+        if not candidates:
+            if agent_id is not None:
+                raise Exception(f"Eliza agent {agent_id} is not available")
+            raise Exception(f"No Eliza agent matches agent_selector '{self.valves.agent_selector}'")
+        
+        route_key = f"{self.valves.state_key_prefix}:route:{channel_key}"
+        route = self._routes.get(channel_key)
+        if route is None:
+            stored = await self._store_get(route_key)
+            route = tuple(json.loads(stored)) if stored else None
+        if route is not None:
+            for candidate in candidates:
+                if (candidate[0], candidate[2]) == route:
+                    self._remember_route(channel_key, route)
+                    return candidate
+            self.metrics["reroutes"] += 1
+        
+        if self.valves.routing_strategy.lower() == "least_outstanding":
+            # Ties go to the hash order so idle agents still share new chats evenly
+            choice = min(
+                candidates,
+                key=lambda c: (
+                    self._outstanding.get((c[0], c[2]), 0),
+                    -self._rendezvous_score(channel_key, c[0], c[2]),
+                ),
+            )
+        else:
+            choice = max(candidates, key=lambda c: self._rendezvous_score(channel_key, c[0], c[2]))
+        
+        url, _, agent_id = choice
+        if route is not None:
+            # The chat's channel on this instance, if any, may belong to another agent
+            self._channels.discard((url, channel_key))
+            await self._store_delete(self._state_key("channel", self._channel_name(channel_key), url))
+        self._remember_route(channel_key, (url, agent_id))
+        await self._store_set(route_key, json.dumps([url, agent_id]), self.valves.channel_ttl)
+        return choice
+
+    def _remember_route(self, channel_key: str, route: tuple[str, str]):
+        self._routes[channel_key] = route
+        self._routes.move_to_end(channel_key)
+        while len(self._routes) > max(1, self.valves.channel_cache_size):
+            self._routes.popitem(last=False)
+
+    def _forget_route(self, channel_key: str):
+        self._routes.pop(channel_key, None)
+        self._spawn(self._store_delete(f"{self.valves.state_key_prefix}:route:{channel_key}"))
+
+    async def _invalidate_if_gone(
+        self, channel_key: str, channel_id: Optional[str], agent_id: Optional[str]
+    ):
+        """Drop cached ids only when Eliza confirms they no longer exist.
         
-        # Step 4: Create new channel if none exists
+        Timeouts and server errors prove nothing, so they leave the caches
+        untouched instead of forcing every later request to rediscover.
+        """
+        checks = {}
+        if channel_id:
+            checks["channel"] = self._request(
+                "GET", f"{self._eliza_url}/api/messaging/central-channels/{channel_id}/details"
+            )
+        if agent_id:
+            checks["agent"] = self._request(
+                "GET", f"{self._eliza_url}/api/agents/{agent_id}"
+            )
+        results = dict(zip(checks, await asyncio.gather(*checks.values(), return_exceptions=True)))
+        
+        def gone(name: str) -> bool:
+            result = results.get(name)
+            return isinstance(result, tuple) and result[0] == 404
+        
+        if gone("agent"):
+            self.metrics["invalidations"] += 1
+            self._discovery.invalidate(self._eliza_url)
+            self._channels.discard((self._eliza_url, channel_key))
+            self._forget_route(channel_key)
+            await self._store_delete(self._state_key("discovery", "directory"))
+        if gone("channel"):
+            self.metrics["invalidations"] += 1
+            self._channels.discard((self._eliza_url, channel_key))
+            self._forget_channel(channel_id)
+            await self._store_delete(self._state_key("channel", self._channel_name(channel_key)))
+
+    async def _setup_channel(
+        self, channel_name: str, server_id: str, agent_id: str, history: Optional[list] = None
+    ) -> str:
+        """Reuse the agent's existing channel with this name, or create one seeded with the chat's history"""
+        channels = await self._list_channels(server_id)
+        
+        # Step 3: Reuse an existing channel with this name that already has the agent
+        candidates = [
+            channel for channel in channels
+            if channel.get("name") == channel_name and not (channel.get("metadata") or {}).get("archived")
+        ]
+        if candidates:
+            has_agent = await asyncio.gather(
+                *(self._channel_has_agent(channel["id"], agent_id) for channel in candidates)
+            )
+            for channel, found in zip(candidates, has_agent):
+                if found:
+                    await self._store_set(
+                        self._state_key("channel", channel_name), channel["id"], self.valves.channel_ttl
+                    )
+                    return channel['id']
+        
+        channel_id = await self._claim_pooled_channel(channel_name, agent_id)
+        if channel_id is None:
+            channel_id = await self._create_channel(channel_name, server_id, agent_id)
+        
+        # Publish the channel atomically; if another worker won the race, use theirs
+        winner = await self._store_add(
+            self._state_key("channel", channel_name), channel_id, self.valves.channel_ttl
+        )
+        if winner != channel_id:
+            self._spawn(
+                self._request("DELETE", f"{self._eliza_url}/api/messaging/central-channels/{channel_id}")
+            )
+            return winner
+        
+        # A chat coming back after its channel was retired keeps its context, as after a rotation
+        carryover = self._carryover_text(history or [])
+        if carryover:
+            self._carryover[channel_id] = carryover
+        return channel_id
+
+    async def _create_channel(self, channel_name: str, server_id: str, agent_id: str) -> str:
+        """Create a channel and add the agent to it"""
+        # Step 4: Create the channel
         create_channel_payload = {
-            "name": self.valves.channel_name,
+            "name": channel_name,
             "serverId": server_id,
             "description": "OpenWebUI chat channel",
             "type": "text"
         }
         
-        channel_response = requests.post(
-            f"{self.valves.eliza_url}/api/messaging/channels",
-            json=create_channel_payload,
-            timeout=10
+        status, channel_data = await self._request(
+            "POST",
+            f"{self._eliza_url}/api/messaging/channels",
+            create_channel_payload,
         )
         
-        if channel_response.status_code not in [200, 201]:
-            raise Exception(f"Failed to create channel: {channel_response.text}")
+        if status not in [200, 201]:
+            raise Exception(f"Failed to create channel: {channel_data}")
         
-        channel_data = channel_response.json()
         channel_id = channel_data["data"]["channel"]["id"]
         
         # Step 5: Add Agent to Channel
@@ -168,16 +1306,602 @@ class Pipe:
             "agentId": agent_id
         }
         
-        add_agent_response = requests.post(
-            f"{self.valves.eliza_url}/api/messaging/central-channels/{channel_id}/agents",
-            json=add_agent_payload,
-            timeout=10
+        status, add_agent_data = await self._request(
+            "POST",
+            f"{self._eliza_url}/api/messaging/central-channels/{channel_id}/agents",
+            add_agent_payload,
+        )
+        
+        if status not in [200, 201]:
+            raise Exception(f"Failed to add agent to channel: {add_agent_data}")
+        
+        return channel_id
+
+    def _pool_name(self) -> str:
+        return f"{self.valves.channel_name}__pool"
+
+    async def _claim_pooled_channel(self, channel_name: str, agent_id: str) -> Optional[str]:
+        """Take a ready channel from the pool and give it the chat's name, or None if the pool is empty"""
+        pool = self._channel_pool.get((self._eliza_url, agent_id))
+        while pool:
+            channel_id = pool.pop()
+            claimed = await self._store_add(
+                self._state_key("pooled", channel_id), channel_name, self.valves.channel_ttl
+            )
+            if claimed != channel_name:
+                continue  # Another worker adopted the same channel and claimed it first
+            self.metrics["pool_hits"] += 1
+            # Lookups by name only matter on a cache miss, so the rename can trail behind
+            self._spawn(
+                self._request(
+                    "PATCH",
+                    f"{self._eliza_url}/api/messaging/central-channels/{channel_id}",
+                    {"name": channel_name},
+                )
+            )
+            return channel_id
+        if self.valves.channel_pool_size > 0 and self.valves.per_chat_channels:
+            self.metrics["pool_misses"] += 1
+        return None
+
+    def _ensure_pool(self, server_id: str, agent_id: str):
+        """Top up the agent's channel pool in the background when it runs low"""
+        if not self.valves.per_chat_channels:
+            return  # Shared channels are set up once, so a pool would sit unused
+        key = (self._eliza_url, agent_id)
+        if len(self._channel_pool.get(key, ())) < self.valves.channel_pool_size:
+            self._spawn(
+                self._single_flight(("pool",) + key, lambda: self._refill_pool(server_id, agent_id))
+            )
+
+    async def _refill_pool(self, server_id: str, agent_id: str):
+        key = (self._eliza_url, agent_id)
+        pool = self._channel_pool.setdefault(key, [])
+        if key not in self._pool_adopted and self._get_store() is not None:
+            # Reuse ready channels left by earlier workers before creating more. Only a shared
+            # store makes each claim atomic; without one they may be another worker's live pool
+            self._pool_adopted.add(key)
+            leftovers = [
+                channel["id"] for channel in await self._list_channels(server_id)
+                if channel.get("name") == self._pool_name()
+                and not (channel.get("metadata") or {}).get("archived")
+                and channel["id"] not in pool
+            ]
+            has_agent, claimed = await asyncio.gather(
+                asyncio.gather(*(self._channel_has_agent(channel_id, agent_id) for channel_id in leftovers)),
+                asyncio.gather(*(self._store_get(self._state_key("pooled", channel_id)) for channel_id in leftovers)),
+            )
+            # Claimed channels already serve a chat whose rename has not landed yet
+            unclaimed = [
+                channel_id for channel_id, found, owner in zip(leftovers, has_agent, claimed)
+                if found and owner is None
+            ]
+            keep = max(0, self.valves.channel_pool_size - len(pool))
+            pool.extend(unclaimed[:keep])
+            for channel_id in unclaimed[keep:]:
+                # Claim the surplus first so no other worker hands it out while it is retired
+                if await self._store_add(
+                    self._state_key("pooled", channel_id), "retired", self.valves.channel_ttl
+                ) == "retired":
+                    await self._retire_channel(channel_id, self.valves.evicted_channel_action.lower())
+        missing = self.valves.channel_pool_size - len(pool)
+        if missing > 0:
+            created = await asyncio.gather(
+                *(self._create_channel(self._pool_name(), server_id, agent_id) for _ in range(missing)),
+                return_exceptions=True,
+            )
+            pool.extend(channel_id for channel_id in created if isinstance(channel_id, str))
+
+    async def _retire_channels(self, evicted: list[tuple[tuple[str, str], str]]):
+        """Archive or delete the channels of chats evicted from the channel map"""
+        action = self.valves.evicted_channel_action.lower()
+        for (url, key), channel_id in evicted:
+            if not key or not self.valves.per_chat_channels:
+                continue  # Never retire the shared fallback channels
+            # Evicted channels may live on another instance than the request that evicted them
+            _current_eliza_url.set(url)
+            if await self._store_get(self._state_key("channel", self._channel_name(key))) == channel_id:
+                continue  # Still in use by another worker
+            await self._retire_channel(channel_id, action)
+
+    async def _retire_channel(self, channel_id: str, action: str):
+        """Stop following a channel, then delete or archive it according to action"""
+        socket = _eliza_sockets.get(self._eliza_url)
+        if socket is not None:
+            socket.forget(channel_id)
+        self._forget_channel(channel_id)
+        url = f"{self._eliza_url}/api/messaging/central-channels/{channel_id}"
+        try:
+            if action == "delete":
+                await self._request("DELETE", url)
+            elif action == "archive":
+                await self._request(
+                    "PATCH",
+                    url,
+                    {"metadata": {"archived": True, "archivedAt": int(time.time() * 1000)}},
+                )
+        except Exception:
+            pass  # Best effort; the channel is no longer on any request path
+
+    def _forget_channel(self, channel_id: str):
+        """Drop the per-channel read state kept by this worker"""
+        self._cursors.pop(channel_id, None)
+        self._channel_usage.pop(channel_id, None)
+        self._carryover.pop(channel_id, None)
+        self._index.pop(channel_id, None)
+        self._pending.pop(channel_id, None)
+
+    def _record_usage(self, channel_id: str, messages: int, size: int):
+        usage = self._channel_usage.setdefault(channel_id, [0, 0, time.time()])
+        usage[0] += messages
+        usage[1] += size
+
+    def _needs_rotation(self, channel_id: str) -> bool:
+        """Whether the channel has grown past any of the rotation thresholds"""
+        usage = self._channel_usage.get(channel_id)
+        if usage is None:
+            return False
+        messages, size, started = usage
+        limits = (
+            (self.valves.rotate_after_messages, messages),
+            (self.valves.rotate_after_bytes, size),
+            (self.valves.rotate_after_seconds, time.time() - started),
+        )
+        return any(limit > 0 and value >= limit for limit, value in limits)
+
+    def _carryover_text(self, history: list) -> str:
+        """Summarise the last few turns so a fresh channel keeps the conversation's context"""
+        turns = max(0, self.valves.rotation_carryover_turns)
+        if not turns:
+            return ""
+        lines = []
+        for message in history[-2 * turns:]:
+            content = message.get("content")
+            if message.get("role") not in ("user", "assistant") or not isinstance(content, str):
+                continue
+            content = content.strip()
+            if len(content) > self.CARRYOVER_CHARS:
+                content = content[:self.CARRYOVER_CHARS] + "..."
+            lines.append(f"{message['role'].capitalize()}: {content}")
+        if not lines:
+            return ""
+        return "Context from earlier in this conversation:\n" + "\n".join(lines) + "\n\n"
+
+    async def _rotate_channel(
+        self,
+        channel_key: str,
+        channel_id: str,
+        server_id: str,
+        agent_id: str,
+        history: list,
+    ) -> str:
+        """Move the chat to a fresh channel, sharing one rotation between concurrent requests"""
+        channel_name = self._channel_name(channel_key)
+        
+        async def rotate() -> str:
+            new_channel_id = await self._claim_pooled_channel(channel_name, agent_id)
+            if new_channel_id is None:
+                new_channel_id = await self._create_channel(channel_name, server_id, agent_id)
+            await self._store_set(
+                self._state_key("channel", channel_name), new_channel_id, self.valves.channel_ttl
+            )
+            self._channels.put((self._eliza_url, channel_key), new_channel_id)
+            carryover = self._carryover_text(history)
+            if carryover:
+                self._carryover[new_channel_id] = carryover
+            self.metrics["rotations"] += 1
+            # The old channel is always at least archived so name lookups skip it
+            action = "delete" if self.valves.evicted_channel_action.lower() == "delete" else "archive"
+            self._spawn(self._retire_channel(channel_id, action))
+            return new_channel_id
+        
+        return await self._single_flight(("rotate", self._eliza_url, channel_id), rotate)
+
+    def _spawn(self, coro: Awaitable[Any]):
+        """Run a best-effort coroutine in the background, keeping a reference until it ends"""
+        task = asyncio.ensure_future(self._detached(coro))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        # Retrieve the exception so failed background work is not reported as unhandled
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    @staticmethod
+    async def _detached(coro: Awaitable[Any]) -> Any:
+        # Background work outlives the request, so it does not share its deadline
+        _request_deadline.set(None)
+        return await coro
+
+    def _schedule_channel_cleanup(self):
+        evicted = self._channels.take_evicted()
+        if evicted:
+            self._spawn(self._retire_channels(evicted))
+
+    @staticmethod
+    def _message_timestamp(msg: dict) -> Optional[float]:
+        """Return a message's creation time in epoch milliseconds, if it has one"""
+        value = msg.get("created_at", msg.get("createdAt"))
+        if isinstance(value, (int, float)):
+            return float(value)
+        if isinstance(value, str) and value:
+            try:
+                return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() * 1000
+            except ValueError:
+                return None
+        return None
+
+    async def _try_endpoint(
+        self, template: str, channel_id: str, agent_id: str, params: Optional[dict]
+    ) -> Optional[list]:
+        """Fetch a page of messages from one endpoint, or None if it has none to give"""
+        endpoint = self._eliza_url + template.format(
+            channel_id=channel_id, agent_id=agent_id
         )
+        try:
+            status, check_data = await self._request("GET", endpoint, params=params)
+            
+            if status == 200:
+                if (check_data.get("success") and 
+                    isinstance(check_data.get("data", {}).get("messages"), list)):
+                    return check_data["data"]["messages"]
+        except DeadlineExceeded:
+            raise  # Running out of time says nothing about the endpoint
+        except Exception:
+            pass
+        return None
+
+    async def _probe_endpoints(
+        self, channel_id: str, agent_id: str, params: Optional[dict]
+    ) -> Optional[list]:
+        """Try every message endpoint at once and learn the first one that works"""
+        self.metrics["endpoint_probes"] += 1
+        tasks = {
+            asyncio.ensure_future(
+                self._try_endpoint(template, channel_id, agent_id, params)
+            ): template
+            for template in self.MESSAGE_ENDPOINTS
+        }
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Prefer the canonical endpoint order when several answer together
+                for task in sorted(done, key=lambda t: self.MESSAGE_ENDPOINTS.index(tasks[t])):
+                    page = task.result()
+                    if page is not None:
+                        self._preferred_endpoints[self._eliza_url] = tasks[task]
+                        self.metrics["preferred_endpoints"][self._eliza_url] = tasks[task]
+                        return page
+        finally:
+            for task in pending:
+                task.cancel()
+        return None
+
+    async def _fetch_channel_messages(
+        self, channel_id: str, agent_id: str, params: Optional[dict] = None
+    ) -> Optional[list]:
+        """Fetch a page of the channel's messages from the deployment's working endpoint"""
+        preferred = self._preferred_endpoints.get(self._eliza_url)
+        if preferred is not None:
+            page = await self._try_endpoint(preferred, channel_id, agent_id, params)
+            if page is not None:
+                return page
+            # Only re-probe once the learned endpoint stops working
+            self.metrics["endpoint_failures"] += 1
+            self._preferred_endpoints.pop(self._eliza_url, None)
+            self.metrics["preferred_endpoints"].pop(self._eliza_url, None)
+        
+        return await self._probe_endpoints(channel_id, agent_id, params)
+
+    async def _fetch_new_messages(
+        self, channel_id: str, agent_id: str, floor: Optional[float] = None
+    ) -> Optional[list]:
+        """Fetch only the messages newer than the channel's high-water mark.
+        
+        Eliza returns messages newest first, so pages are read backwards with
+        `before` until one reaches the mark. Anything older than `floor` (our
+        own message's timestamp) is treated as already seen.
+        """
+        mark, mark_ids = self._cursors.get(channel_id, (None, set()))
+        if floor is not None and (mark is None or floor > mark):
+            mark, mark_ids = floor, set()
         
-        if add_agent_response.status_code not in [200, 201]:
-            raise Exception(f"Failed to add agent to channel: {add_agent_response.text}")
+        page_size = max(1, self.valves.message_page_size)
+        new_messages = []
+        seen_ids = set()
+        before = None
         
-        return channel_id, server_id, agent_id
+        for _ in range(max(1, self.valves.max_message_pages)):
+            params = {"limit": page_size}
+            if before is not None:
+                params["before"] = int(before)
+            page = await self._fetch_channel_messages(channel_id, agent_id, params)
+            if page is None:
+                if not new_messages:
+                    return None
+                break
+            
+            reached_mark = False
+            added = 0
+            oldest = None
+            for msg in page:
+                msg_id = msg.get("id")
+                created_at = self._message_timestamp(msg)
+                if created_at is not None:
+                    oldest = created_at if oldest is None else min(oldest, created_at)
+                if msg_id in seen_ids:
+                    continue
+                if mark is not None and created_at is not None and (
+                    created_at < mark or (created_at == mark and msg_id in mark_ids)
+                ):
+                    reached_mark = True
+                    continue
+                seen_ids.add(msg_id)
+                new_messages.append(msg)
+                added += 1
+            
+            # Stop once the page overlaps what we have seen, or there is nothing older
+            if reached_mark or mark is None or added == 0 or len(page) < page_size or oldest is None:
+                break
+            before = oldest + 1  # `before` is exclusive; duplicates are skipped by id
+        
+        # Advance the high-water mark to the newest message returned
+        for msg in new_messages:
+            created_at = self._message_timestamp(msg)
+            if created_at is None:
+                continue
+            if mark is None or created_at > mark:
+                mark, mark_ids = created_at, {msg.get("id")}
+            elif created_at == mark:
+                mark_ids = mark_ids | {msg.get("id")}
+        if mark is not None:
+            self._cursors[channel_id] = (mark, mark_ids)
+        
+        return new_messages
+
+    def _message_record(self, channel_id: str, msg: dict, fetched: bool = False) -> MessageRecord:
+        """Return the channel's record for a message, indexing it on first sight"""
+        msg_id = msg.get("id")
+        index = self._index.setdefault(channel_id, OrderedDict())
+        record = index.get(msg_id) if msg_id else None
+        reply_to = msg.get("inReplyToRootMessageId") or msg.get("in_reply_to_message_id")
+        if record is None:
+            record = MessageRecord(msg_id, self._message_timestamp(msg), reply_to)
+            if msg_id:
+                index[msg_id] = record
+                if len(index) > self.INDEX_SIZE:
+                    index.popitem(last=False)
+        if fetched:
+            record.fetched = True
+            record.reply_to = record.reply_to or reply_to
+        return record
+
+    def _is_agent_reply(
+        self,
+        msg: dict,
+        record: MessageRecord,
+        agent_id: str,
+        sent_message_id: Optional[str],
+        sent_at: Optional[float],
+        user_content: str,
+    ) -> bool:
+        """Decide whether a channel message is the agent's reply to our message"""
+        if sent_message_id and record.id == sent_message_id:
+            return False
+        
+        # Replies that name their root message are correlated exactly
+        if sent_message_id and record.reply_to:
+            return record.reply_to == sent_message_id
+        
+        # Anything older than our message belongs to an earlier turn
+        if sent_at is not None and record.created_at is not None and record.created_at < sent_at:
+            return False
+        
+        if (msg.get("authorId") or msg.get("author_id")) == agent_id:
+            return True
+        if (msg.get("sourceType") or msg.get("source_type")) == "agent_response":
+            return True
+        
+        content = msg.get("content", "").strip()
+        
+        # Skip user input messages (they contain our exact input)
+        if content == user_content.strip():
+            return False
+        
+        # Detect agent responses by content patterns
+        if record.looks_like_reply is None:
+            record.looks_like_reply = len(content) > 10 and AGENT_REPLY_PATTERN.search(content) is not None
+        return record.looks_like_reply
+
+    async def _subscribe_channel(
+        self, channel_id: str, server_id: str
+    ) -> Optional[ChannelSubscription]:
+        """Subscribe to pushed channel messages, or return None to poll instead"""
+        mode = self.valves.delivery_mode.lower()
+        if mode == "poll":
+            return None
+        if socketio is None:
+            if mode == "socket":
+                raise Exception("delivery_mode 'socket' requires the python-socketio package")
+            return None
+        
+        socket = _eliza_sockets.get(self._eliza_url)
+        if socket is None:
+            socket = _eliza_sockets[self._eliza_url] = ElizaSocket(self._eliza_url)
+        try:
+            return await socket.subscribe(
+                channel_id, server_id, self._remaining(self.valves.socket_connect_timeout)
+            )
+        except Exception:
+            if mode == "socket":
+                raise
+            return None  # Fall back to polling
+
+    async def _stream_replies(
+        self,
+        channel_id: str,
+        agent_id: str,
+        sent_message_id: Optional[str],
+        sent_at: Optional[float],
+        user_content: str,
+        seen_messages: deque,
+        __event_emitter__: Callable[[dict], Awaitable[None]] = None,
+        subscription: Optional[ChannelSubscription] = None,
+    ) -> AsyncGenerator[list, None]:
+        """Yield batches of the agent's reply messages as soon as they are pushed or polled.
+        
+        Stops once correlated replies have been quiet for the quiescence window,
+        or when the response timeout is reached. If the subscription's socket
+        drops, the remaining wait falls back to polling with adaptive backoff.
+        Every new message seen is appended to seen_messages for diagnostics.
+        An empty batch means only the request's held text is due.
+        Messages stay pending on the channel until some turn claims them as
+        its reply, so turns sharing a channel each get their own replies and
+        none is returned twice.
+        """
+        started = time.monotonic()
+        deadline = started + self.valves.response_timeout
+        if _request_deadline.get() is not None:
+            # Stop waiting when the request's overall budget runs out
+            deadline = min(deadline, _request_deadline.get())
+        interval = self.valves.poll_interval
+        last_reply_at = None
+        batcher = _request_batcher.get()
+        pending = self._pending.setdefault(channel_id, OrderedDict())
+        self._waiting_turns[channel_id] = self._waiting_turns.get(channel_id, 0) + 1
+        try:
+            while True:
+                now = time.monotonic()
+                wait = min(self.valves.max_poll_interval, deadline - now)
+                if last_reply_at is not None:
+                    wait = min(wait, last_reply_at + self.valves.quiescence_window - now)
+                if batcher is not None and batcher.due_in() is not None:
+                    wait = min(wait, batcher.due_in())
+                shared = self._waiting_turns[channel_id] > 1
+                
+                pushed = subscription is not None and subscription.connected
+                messages, fetched = [], []
+                try:
+                    if pushed:
+                        messages = await subscription.get_batch(wait)
+                        if shared and any(
+                            not (msg.get("inReplyToRootMessageId") or msg.get("in_reply_to_message_id"))
+                            for msg in messages
+                        ):
+                            # Pushes carry no reply link, so read it before telling the turns' replies apart
+                            fetched = await self._fetch_new_messages(channel_id, agent_id, sent_at) or []
+                    else:
+                        fetched = await self._fetch_new_messages(channel_id, agent_id, sent_at) or []
+                except DeadlineExceeded:
+                    if last_reply_at is None:
+                        raise  # Nothing to show; report the deadline rather than a missing reply
+                    break  # The wait ends with the request's budget, keeping the replies so far
+                now = time.monotonic()
+                
+                seen_messages.extend(messages)
+                seen_messages.extend(fetched)
+                for batch, from_api in ((messages, False), (fetched, True)):
+                    for msg in batch:
+                        record = self._message_record(channel_id, msg, from_api)
+                        if not record.delivered and (record.message is None or from_api):
+                            record.message = msg
+                            pending[record.id or id(record)] = record
+                while len(pending) > self.INDEX_SIZE:
+                    pending.popitem(last=False)[1].message = None
+                
+                # Check everything still unclaimed, including messages other turns read for us
+                new_replies = []
+                for key, record in list(pending.items()):
+                    if record.delivered:
+                        pending.pop(key, None)
+                        continue
+                    if shared and record.reply_to is None and not record.fetched:
+                        continue  # Wait for its reply link rather than guess whose reply it is
+                    if self._is_agent_reply(
+                        record.message, record, agent_id, sent_message_id, sent_at, user_content
+                    ):
+                        record.delivered = True
+                        pending.pop(key, None)
+                        new_replies.append((record.created_at or 0, record.message))
+                        record.message = None
+                
+                if new_replies:
+                    # Sort by timestamp to ensure proper chronological order (oldest first)
+                    new_replies.sort(key=lambda reply: reply[0])
+                    yield [msg for _, msg in new_replies]
+                    # Follow-up parts usually arrive close together, so check again soon
+                    last_reply_at = now
+                    interval = self.valves.poll_interval
+                else:
+                    interval = min(interval * self.valves.poll_backoff, self.valves.max_poll_interval)
+                if batcher is not None and batcher.due_in() == 0:
+                    yield []
+            
+                if last_reply_at is not None and now - last_reply_at >= self.valves.quiescence_window:
+                    break
+                if now >= deadline:
+                    if last_reply_at is None and deadline == _request_deadline.get():
+                        # The request's budget ran out before the agent said anything
+                        raise DeadlineExceeded(
+                            f"Eliza did not finish within the {self.valves.request_deadline:g}s request deadline"
+                        )
+                    break
+            
+                await self.emit_status(
+                    __event_emitter__,
+                    "info",
+                    f"Waiting for agent response... ({int(now - started)}s)",
+                    False,
+                )
+            
+                if not pushed:
+                    delay = min(interval, deadline - now)
+                    if last_reply_at is not None:
+                        delay = min(delay, last_reply_at + self.valves.quiescence_window - now)
+                    held = batcher.due_in() if batcher is not None else None
+                    if held is not None and held < delay:
+                        # Send the held text on time without polling any sooner
+                        await asyncio.sleep(held)
+                        yield []
+                        delay -= held
+                    await asyncio.sleep(max(delay, 0))
+        finally:
+            self._waiting_turns[channel_id] -= 1
+            if not self._waiting_turns[channel_id]:
+                # Nobody is waiting on this channel any more
+                del self._waiting_turns[channel_id]
+                self._pending.pop(channel_id, None)
+
+    def _build_debug_report(
+        self, channel_id: str, sent_message_id: Optional[str], seen_messages: deque
+    ) -> dict:
+        """Summarise the most recent messages seen while waiting, for the no-reply path"""
+        return {
+            "channel_id": channel_id,
+            "sent_message_id": sent_message_id,
+            "messages": [
+                {
+                    "source_type": msg.get("sourceType", msg.get("source_type")),
+                    "author_id": msg.get("authorId", msg.get("author_id")),
+                    "in_reply_to": msg.get("inReplyToRootMessageId", msg.get("in_reply_to_message_id")),
+                    "content_preview": msg.get("content", "")[:30],
+                }
+                for msg in seen_messages
+            ],
+            "metrics": self.metrics,
+        }
+
+    @staticmethod
+    def _format_debug_report(report: dict) -> str:
+        lines = [
+            f"DEBUG: sent_message_id='{report['sent_message_id']}'. "
+            f"Last {len(report['messages'])} messages found:"
+        ]
+        for i, msg in enumerate(report["messages"], 1):
+            lines.append(
+                f"  {i}. source_type='{msg['source_type']}', author_id='{msg['author_id']}', "
+                f"in_reply_to='{msg['in_reply_to']}', content_preview='{msg['content_preview']}...'"
+            )
+        return "\n".join(lines) + "\n"
 
     async def pipe(
         self,
@@ -185,32 +1909,106 @@ class Pipe:
         __user__: Optional[dict] = None,
         __event_emitter__: Callable[[dict], Awaitable[None]] = None,
         __event_call__: Callable[[dict], Awaitable[dict]] = None,
-    ) -> Optional[dict]:
+    ) -> AsyncGenerator[str, None]:
+        # Every step below draws its timeout from this one budget
+        _request_deadline.set(
+            time.monotonic() + self.valves.request_deadline if self.valves.request_deadline > 0 else None
+        )
+        batcher = EventBatcher(
+            __event_emitter__, self.valves.flush_window, self.valves.flush_bytes, self.valves.emit_interval
+        )
+        _request_batcher.set(batcher)
         await self.emit_status(
             __event_emitter__, "info", "Starting Eliza workflow...", False
         )
         
         messages = body.get("messages", [])
         if not messages:
-            return {"error": "No messages found in the request body"}
+            yield "No messages found in the request body"
+            return
 
         user_content = messages[-1]["content"]
+        subscription = None
+        
+        # Each chat gets its own channel so reads only cover that conversation
+        chat_id, _ = extract_event_info(__event_emitter__)
+        channel_key = chat_id if chat_id and self.valves.per_chat_channels else ""
+        model_agent_id = None
+        if self.valves.manifold_mode:
+            # Manifold model ids look like "<function id>.<agent id>"
+            model_agent_id = body.get("model", "").partition(".")[2] or None
+            if model_agent_id:
+                # Each agent keeps its own channel, even within one chat
+                channel_key = f"{channel_key}_{model_agent_id}" if channel_key else model_agent_id
+        channel_name = self._channel_name(channel_key)
+        
+        channel_id = None
+        agent_id = None
+        route = None
+        admitted = False
         
         try:
-            # Get or create channel (cached for efficiency)
-            if not all([self._cached_channel_id, self._cached_server_id, self._cached_agent_id]):
+            # Place the chat on an agent, then talk to that agent's instance for the rest of the request
+            url, server_id, agent_id = await self._route(channel_key, model_agent_id)
+            _current_eliza_url.set(url)
+            route = (url, agent_id)
+            self._outstanding[route] = self._outstanding.get(route, 0) + 1
+            
+            # Queue behind other turns when Eliza already has as much work as it should take
+            self._admission.configure(self.valves.max_in_flight)
+            
+            async def report_position(position: int):
+                await self.emit_status(
+                    __event_emitter__, "info", f"Eliza is busy, waiting in queue (position {position})...", False
+                )
+            
+            if self._admission.busy:
+                self.metrics["queued"] += 1
+            await self._admission.acquire(
+                (__user__ or {}).get("id") or chat_id or "",
+                report_position,
+                self.valves.emit_interval,
+                self._remaining,
+            )
+            admitted = True
+            
+            # Get or create this chat's channel (cached for efficiency)
+            self._channels.configure(self.valves.channel_cache_size, self.valves.channel_ttl)
+            channel_state_key = self._state_key("channel", channel_name)
+            channel_id = self._channels.get((url, channel_key)) or await self._store_get(channel_state_key)
+            if not channel_id:
                 await self.emit_status(__event_emitter__, "info", "Setting up communication channel...", False)
-                self._cached_channel_id, self._cached_server_id, self._cached_agent_id = self._get_or_create_channel()
+                channel_id = await self._get_or_create_channel(
+                    channel_name, server_id, agent_id, messages[:-1]
+                )
             else:
                 await self.emit_status(__event_emitter__, "info", "Using existing communication channel...", False)
+                if self._get_store() is not None:
+                    # Keep the shared mapping alive while the chat is in use
+                    self._spawn(self._store_set(channel_state_key, channel_id, self.valves.channel_ttl))
+            self._channels.put((url, channel_key), channel_id)
+            self._schedule_channel_cleanup()
             
-            channel_id = self._cached_channel_id
-            server_id = self._cached_server_id
-            agent_id = self._cached_agent_id
+            # Keep per-turn reads bounded by moving long-lived chats to a fresh channel
+            if self._needs_rotation(channel_id):
+                await self.emit_status(__event_emitter__, "info", "Starting a fresh communication channel...", False)
+                try:
+                    channel_id = await self._rotate_channel(
+                        channel_key, channel_id, server_id, agent_id, messages[:-1]
+                    )
+                except Exception:
+                    pass  # Keep using the current channel; rotation is retried next turn
+            # Top up after claiming, so the pool is back to full size for the next new chat
+            self._ensure_pool(server_id, agent_id)
+            
+            # Subscribe before sending so no pushed reply can be missed
+            subscription = await self._subscribe_channel(channel_id, server_id)
             
             # Send Message (EXACT N8N payload structure)
             await self.emit_status(__event_emitter__, "info", "Sending message to agent...", False)
             
+            # The first message in a rotated channel carries the recent turns with it
+            user_content = self._carryover.pop(channel_id, "") + user_content
             message_payload = {
                 "channel_id": channel_id,
                 "server_id": server_id,
@@ -225,181 +2023,144 @@ class Pipe:
                 }
             }
             
-            send_response = requests.post(
-                f"{self.valves.eliza_url}/api/messaging/submit",
-                json=message_payload,
-                timeout=10
+            status, send_data = await self._request(
+                "POST",
+                f"{self._eliza_url}/api/messaging/submit",
+                message_payload,
             )
             
-            if send_response.status_code not in [200, 201]:
-                return {"error": f"Failed to send message: {send_response.text}"}
+            if status not in [200, 201]:
+                await self._invalidate_if_gone(channel_key, channel_id, agent_id)
+                error_msg = f"Failed to send message: {send_data}"
+                await self.emit_status(__event_emitter__, "error", error_msg, True)
+                yield error_msg
+                return
             
             # Get the message ID from the send response to track our specific message
-            send_data = send_response.json()
             # Try different possible fields for message ID
             sent_message_id = None
+            sent_at = None
             if send_data.get("success"):
                 data = send_data.get("data", {})
                 sent_message_id = (data.get("message_id") or 
                                  data.get("messageId") or 
-                                 data.get("id") or
-                                 data.get("channelId"))  # Sometimes the response structure varies
-            
-            # Wait longer and try multiple endpoints to find agent responses
-            # Since agent responses might take time to appear in the channel
-            time.sleep(self.valves.wait_time + 5)  # Wait longer initially
-            
-            # Try alternative endpoints to get messages
-            possible_endpoints = [
-                f"{self.valves.eliza_url}/api/messaging/central-channels/{channel_id}/messages",
-                f"{self.valves.eliza_url}/api/messaging/channels/{channel_id}/messages",
-                f"{self.valves.eliza_url}/api/agents/{agent_id}/messages"
-            ]
+                                 data.get("id"))  # Sometimes the response structure varies
+                # Remember when our message landed so replies to earlier turns are ignored
+                sent_at = self._message_timestamp(data)
             
+            # Stream each agent message to the chat as soon as it shows up
+            await self.emit_status(__event_emitter__, "info", "Waiting for agent response...", False)
+            all_responses = []
             agent_found = False
-            final_response = None
+            turn_messages = 1
+            turn_bytes = len(user_content.encode())
+            # Only the newest messages are kept for the miss-path diagnostics
+            seen_messages = deque(maxlen=max(1, self.valves.debug_report_messages))
             
-            for endpoint in possible_endpoints:
-                try:
-                    check_response = requests.get(endpoint, timeout=10)
-                    
-                    if check_response.status_code == 200:
-                        check_data = check_response.json()
-                        if (check_data.get("success") and 
-                            check_data.get("data", {}).get("messages")):
-                            
-                            check_messages = check_data["data"]["messages"]
-                            # Look for any agent responses
-                            agent_responses = [
-                                msg for msg in check_messages
-                                if (msg.get("source_type") == "agent_response" or
-                                    msg.get("author_id") == agent_id or
-                                    (msg.get("content", "") and 
-                                     msg.get("content", "") != user_content and
-                                     len(msg.get("content", "")) > 10))
-                            ]
-                            
-                            if agent_responses:
-                                agent_found = True
-                                final_response = check_data
-                                break
-                                
-                except Exception as e:
-                    continue  # Try next endpoint
-            
-            # Use the response we found from trying multiple endpoints
-            if final_response:
-                response_data = final_response
-            else:
-                # Fallback to original endpoint
-                response_response = requests.get(
-                    f"{self.valves.eliza_url}/api/messaging/central-channels/{channel_id}/messages",
-                    timeout=10
-                )
-                
-                if response_response.status_code != 200:
-                    return {"error": f"Failed to get response: {response_response.text}"}
-                
-                response_data = response_response.json()
-            
-            # Extract ALL agent responses
-            if (response_data.get("success") and 
-                response_data.get("data", {}).get("messages") and 
-                len(response_data["data"]["messages"]) > 0):
-                
-                messages = response_data["data"]["messages"]
-                
-                # Debug: Let's see what messages we actually have
-                debug_info = f"DEBUG: sent_message_id='{sent_message_id}'. Messages found:\n"
-                for i, msg in enumerate(messages):
-                    debug_info += f"  {i+1}. source_type='{msg.get('source_type')}', "
-                    debug_info += f"author_id='{msg.get('author_id')}', "
-                    debug_info += f"in_reply_to='{msg.get('in_reply_to_message_id')}', "
-                    debug_info += f"content_preview='{msg.get('content', '')[:30]}...'\n"
-                
-                # Since metadata is missing, detect agent responses by content pattern
-                all_agent_messages = []
-                
-                for msg in messages:
-                    content = msg.get("content", "").strip()
-                    
-                    # Skip user input messages (they contain our exact input)
-                    if content == user_content.strip():
-                        continue
-                    
-                    # Detect agent responses by content patterns
-                    is_likely_agent_response = (
-                        content and
-                        len(content) > 10 and
-                        # Look for typical agent response patterns
-                        (content.startswith('I\'ll') or
-                         content.startswith('I will') or
-                         content.startswith('Sure') or
-                         '✅' in content or
-                         'Successfully' in content or
-                         'Transaction:' in content or
-                         'transferred' in content.lower() or
-                         content.startswith('{') and 'follow_ups' in content)
-                    )
-                    
-                    if is_likely_agent_response:
-                        all_agent_messages.append(msg)
-                
-                # Sort by timestamp to ensure proper chronological order (oldest first)
-                if all_agent_messages:
-                    # Sort by createdAt or updatedAt timestamp
-                    all_agent_messages.sort(key=lambda x: x.get("createdAt", x.get("updatedAt", "")))
-                
-                if all_agent_messages:
-                    # Combine all agent responses like a normal chatbot
-                    all_responses = []
-                    
-                    for msg in all_agent_messages:
+            # Close the reply stream right away if the user stops generation
+            async with aclosing(self._stream_replies(
+                channel_id,
+                agent_id,
+                sent_message_id,
+                sent_at,
+                user_content,
+                seen_messages,
+                __event_emitter__,
+                subscription,
+            )) as replies:
+                async for batch in replies:
+                    for msg in batch:
+                        agent_found = True
                         content = msg.get("content", "").strip()
+                        turn_messages += 1
+                        turn_bytes += len(content.encode())
                         
                         # Skip empty messages
                         if not content:
                             continue
                         
-                        # Parse each response and add to the list
-                        parsed_content = self._parse_agent_response(content)
+                        record = self._message_record(channel_id, msg)
+                        if record.text is None:
+                            record.text = self._parse_agent_response(content)
+                        parsed_content = record.text
                         if parsed_content and parsed_content.strip():
+                            # Separate the parts with double newlines for readability
+                            text = await batcher.add(("\n\n" if all_responses else "") + parsed_content)
                             all_responses.append(parsed_content)
-                    
-                    # Join all responses with double newlines for readability
-                    if all_responses:
-                        agent_response = "\n\n".join(all_responses)
-                    else:
-                        agent_response = "No valid agent responses found"
+                            if text:
+                                yield text
+                    # Send held text once its window is up, even if no more parts came in
+                    text = await batcher.add("")
+                    if text:
+                        yield text
+            text = await batcher.flush()
+            if text:
+                yield text
+            
+            self._record_usage(channel_id, turn_messages, turn_bytes)
+            
+            if all_responses:
+                agent_response = "\n\n".join(all_responses)
+            elif agent_found:
+                agent_response = "No valid agent responses found"
+                yield agent_response
+            elif seen_messages:
+                report = self._build_debug_report(channel_id, sent_message_id, seen_messages)
+                if self.valves.debug_to_log:
+                    logger.warning("Eliza pipe found no agent reply: %s", json.dumps(report))
+                    agent_response = "No agent response found in channel. Diagnostics were written to the server log."
                 else:
                     # Include detailed debug information
-                    agent_response = f"No agent response found in channel. {debug_info}"
-                
-                # Set assistant message
-                body["messages"].append({"role": "assistant", "content": agent_response})
-                
-                await self.emit_status(__event_emitter__, "info", "Complete", True)
-                return agent_response
+                    agent_response = f"No agent response found in channel. {self._format_debug_report(report)}"
+                yield agent_response
             else:
                 no_response_msg = "✅ Message sent successfully, but no response received yet. The agent may be processing your request."
                 body["messages"].append({"role": "assistant", "content": no_response_msg})
-                return no_response_msg
+                yield no_response_msg
+                return
+            
+            # Set assistant message
+            body["messages"].append({"role": "assistant", "content": agent_response})
+            
+            await self.emit_status(__event_emitter__, "info", "Complete", True)
                 
+        except DeadlineExceeded as e:
+            # Out of time; nothing suggests the cached ids are wrong, so keep them
+            error_msg = str(e)
+            await self.emit_status(__event_emitter__, "error", error_msg, True)
+            yield error_msg
+        except (asyncio.CancelledError, GeneratorExit):
+            # The user stopped generation; the finally block releases the subscription
+            self.metrics["cancellations"] += 1
+            raise
         except Exception as e:
             error_msg = f"Error in Eliza workflow: {str(e)}"
             await self.emit_status(__event_emitter__, "error", error_msg, True)
-            # Clear cache on error to force refresh
-            self._cached_channel_id = None
-            self._cached_server_id = None
-            self._cached_agent_id = None
-            return {"error": error_msg}
+            if route is not None and isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+                # Send new turns to the other instances while this one is unreachable
+                self._mark_down(route[0])
+            # Only forget what Eliza says is gone; transient errors keep the caches warm
+            try:
+                await self._invalidate_if_gone(channel_key, channel_id, agent_id)
+            except Exception:
+                pass
+            yield error_msg
+        finally:
+            if subscription is not None:
+                subscription.close()
+            if admitted:
+                self._admission.release()
+            if route is not None:
+                self._outstanding[route] -= 1
+                if not self._outstanding[route]:
+                    del self._outstanding[route]
 
     def _parse_agent_response(self, raw_content: str) -> str:
         """Parse the agent response content, handling both JSON and plain text formats"""
+        # Clean up the content first - remove system prompts and unwanted content
+        cleaned_content = self._clean_agent_response(raw_content)
+        
         try:
-            # Clean up the content first - remove system prompts and unwanted content
-            cleaned_content = self._clean_agent_response(raw_content)
-            
             # Try to parse as JSON first
             if cleaned_content.startswith('{') and cleaned_content.endswith('}'):
                 parsed = json.loads(cleaned_content)
@@ -443,43 +2204,31 @@ class Pipe:
             
         except (json.JSONDecodeError, Exception):
             # If JSON parsing fails, return cleaned content
-            return self._clean_agent_response(raw_content)
+            return cleaned_content
 
     def _clean_agent_response(self, content: str) -> str:
         """Clean agent response by removing system prompts and unwanted content"""
         if not content:
             return content
         
-        # Split content into lines for processing
-        lines = content.split('\n')
-        cleaned_lines = []
-        skip_rest = False
+        # Stop processing at the first system prompt marker, found in one scan
+        marker = SYSTEM_PROMPT_MARKERS.search(content)
+        if marker:
+            content = content[:content.rfind('\n', 0, marker.start()) + 1]
         
-        for line in lines:
+        cleaned_lines = []
+        for line in content.split('\n'):
             line = line.strip()
             
             # Skip empty lines at the start
             if not line and not cleaned_lines:
                 continue
                 
-            # Stop processing if we hit system prompt markers
-            if any(marker in line.lower() for marker in [
-                '### task:', '### guidelines:', '### output:', '### chat history:',
-                '<chat_history>', 'json format:', 'response must be', 'suggest 3-5 relevant'
-            ]):
-                skip_rest = True
-                break
-                
             # Skip lines that look like system instructions
-            if any(instruction in line.lower() for instruction in [
-                'write all follow-up questions', 'make questions concise',
-                'only suggest follow-ups', 'use the conversation', 'default to english'
-            ]):
+            if SYSTEM_INSTRUCTION_LINES.search(line):
                 continue
                 
-            # If we haven't hit a stop marker, keep the line
-            if not skip_rest:
-                cleaned_lines.append(line)
+            cleaned_lines.append(line)
         
         # Join back and clean up
         cleaned = '\n'.join(cleaned_lines).strip()
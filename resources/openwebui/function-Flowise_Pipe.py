@@ -2,16 +2,17 @@
 title: Flowise Pipe Function
 author: Seiling Buidlbox
 author_url: https://www.github.com/0xn1c0/seiling-buildbox
-version: 0.1.0
+version: 0.3.0
 
 This module defines a Pipe class that utilizes Flowise for an Agent
 """
 
 from typing import Optional, Callable, Awaitable
 from pydantic import BaseModel, Field
+import asyncio
+import aiohttp
 import os
 import time
-import requests
 
 
 def extract_event_info(event_emitter) -> tuple[Optional[str], Optional[str]]:
@@ -25,6 +26,24 @@ def extract_event_info(event_emitter) -> tuple[Optional[str], Optional[str]]:
     return None, None
 
 
+# One pooled keep-alive session per process, shared by every pipe instance
+_http_session: Optional[aiohttp.ClientSession] = None
+_http_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_http_session(limit: int, limit_per_host: int) -> aiohttp.ClientSession:
+    """Return the process-wide HTTP session, creating it on the running event loop"""
+    global _http_session, _http_session_loop
+    loop = asyncio.get_running_loop()
+    if _http_session is None or _http_session.closed or _http_session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit=limit, limit_per_host=limit_per_host, keepalive_timeout=30
+        )
+        _http_session = aiohttp.ClientSession(connector=connector)
+        _http_session_loop = loop
+    return _http_session
+
+
 class Pipe:
     class Valves(BaseModel):
         flowise_url: str = Field(
@@ -39,6 +58,14 @@ class Pipe:
         enable_status_indicator: bool = Field(
             default=True, description="Enable or disable status indicator emissions"
         )
+        max_connections: int = Field(
+            default=100,
+            description="Size of the process-wide HTTP connection pool (applied when the pool is created)"
+        )
+        max_connections_per_host: int = Field(
+            default=20,
+            description="Maximum pooled connections to a single host (applied when the pool is created)"
+        )
 
     def __init__(self):
         self.type = "pipe"
@@ -46,7 +73,7 @@ class Pipe:
         self.name = "Flowise Pipe"
         self.valves = self.Valves()
         self.last_emit_time = 0
-        pass
+        self.metrics = {"cancellations": 0}
 
     async def emit_status(
         self,
@@ -99,19 +126,21 @@ class Pipe:
                 }
                 payload = {self.valves.input_field: question}
                 
-                response = requests.post(
-                    self.valves.flowise_url, json=payload, headers=headers
+                session = get_http_session(
+                    self.valves.max_connections, self.valves.max_connections_per_host
                 )
-                
-                if response.status_code == 200:
-                    flowise_response = response.json()
-                    # Extract the response text from the Flowise response
-                    if isinstance(flowise_response, dict):
-                        response_text = flowise_response.get(self.valves.response_field, str(flowise_response))
+                async with session.post(
+                    self.valves.flowise_url, json=payload, headers=headers
+                ) as response:
+                    if response.status == 200:
+                        flowise_response = await response.json(content_type=None)
+                        # Extract the response text from the Flowise response
+                        if isinstance(flowise_response, dict):
+                            response_text = flowise_response.get(self.valves.response_field, str(flowise_response))
+                        else:
+                            response_text = str(flowise_response)
                     else:
-                        response_text = str(flowise_response)
-                else:
-                    raise Exception(f"Error: {response.status_code} - {response.text}")
+                        raise Exception(f"Error: {response.status} - {await response.text()}")
 
                 # Set assistant message with chain reply
                 body["messages"].append({"role": "assistant", "content": response_text})
@@ -119,6 +148,10 @@ class Pipe:
                 await self.emit_status(__event_emitter__, "info", "Complete", True)
                 return response_text
                 
+            except asyncio.CancelledError:
+                # The user stopped generation; leaving the request context releases its connection
+                self.metrics["cancellations"] += 1
+                raise
             except Exception as e:
                 await self.emit_status(
                     __event_emitter__,
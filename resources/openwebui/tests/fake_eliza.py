@@ -0,0 +1,252 @@
+"""
+Minimal in-process stand-in for an Eliza server, for testing the Eliza pipe.
+
+Serves the messaging REST endpoints the pipe calls and a Socket.IO endpoint
+that pushes the agent's replies to clients that joined the channel's room.
+Every user message is answered with `parts` agent messages, the first after
+`reply_delay` seconds and the rest `part_gap` seconds apart.
+"""
+
+import asyncio
+import socket
+import threading
+import time
+import uuid
+from typing import Optional
+
+import socketio
+from aiohttp import web
+
+# Eliza's SOCKET_MESSAGE_TYPE.ROOM_JOINING
+ROOM_JOINING = "1"
+
+
+class FakeEliza:
+    """Fake Eliza server running on its own event loop in a background thread"""
+
+    SERVER_ID = "00000000-0000-0000-0000-000000000000"
+
+    def __init__(self, reply_delay: float = 0.1, parts: int = 2, part_gap: float = 0.1):
+        self.reply_delay = reply_delay
+        self.parts = parts
+        self.part_gap = part_gap
+        # Disconnect every socket client right after the first reply part is pushed
+        self.drop_sockets = False
+        self.agent_id = str(uuid.uuid4())
+        self.channels: dict[str, dict] = {}
+        self.requests: dict[str, int] = {}
+        self.pushed = 0
+        self.joins = 0
+        self.port: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+        self._sio = socketio.AsyncServer(async_mode="aiohttp", cors_allowed_origins="*")
+        self._sio.on(ROOM_JOINING, self._join)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            self.port = probe.getsockname()[1]
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(started,), daemon=True)
+        self._thread.start()
+        if not started.wait(10):
+            raise RuntimeError("fake Eliza server did not start")
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+        self._loop = None
+
+    def count(self, route: str) -> int:
+        """How many times a route was requested, e.g. count("GET /api/agents/{aid}")"""
+        return self.requests.get(route, 0)
+
+    def _run(self, started: threading.Event):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._serve())
+        started.set()
+        self._loop.run_forever()
+
+    async def _serve(self):
+        app = web.Application(middlewares=[self._count])
+        self._sio.attach(app)
+        app.add_routes([
+            web.get("/api/messaging/central-servers", self._servers),
+            web.get("/api/agents", self._agents),
+            web.get("/api/agents/{aid}", self._agent),
+            web.get("/api/messaging/central-servers/{sid}/channels", self._list_channels),
+            web.post("/api/messaging/channels", self._create_channel),
+            web.get("/api/messaging/central-channels/{cid}/details", self._details),
+            web.patch("/api/messaging/central-channels/{cid}", self._patch_channel),
+            web.delete("/api/messaging/central-channels/{cid}", self._delete_channel),
+            web.get("/api/messaging/central-channels/{cid}/agents", self._channel_agents),
+            web.post("/api/messaging/central-channels/{cid}/agents", self._add_agent),
+            web.get("/api/messaging/central-channels/{cid}/messages", self._messages),
+            web.post("/api/messaging/submit", self._submit),
+        ])
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+
+    @web.middleware
+    async def _count(self, request: web.Request, handler):
+        resource = request.match_info.route.resource
+        key = f"{request.method} {resource.canonical if resource else request.path}"
+        self.requests[key] = self.requests.get(key, 0) + 1
+        return await handler(request)
+
+    async def _join(self, sid: str, payload: dict):
+        self.joins += 1
+        await self._sio.enter_room(sid, payload.get("channelId"))
+
+    def _channel(self, request: web.Request) -> Optional[dict]:
+        return self.channels.get(request.match_info["cid"])
+
+    @staticmethod
+    def _not_found() -> web.Response:
+        return web.json_response({"success": False, "error": "Channel not found"}, status=404)
+
+    async def _servers(self, request: web.Request) -> web.Response:
+        return web.json_response({"success": True, "data": {"servers": [{"id": self.SERVER_ID}]}})
+
+    async def _agents(self, request: web.Request) -> web.Response:
+        agents = [{"id": self.agent_id, "name": "Eliza", "status": "active"}]
+        return web.json_response({"success": True, "data": {"agents": agents}})
+
+    async def _agent(self, request: web.Request) -> web.Response:
+        if request.match_info["aid"] != self.agent_id:
+            return web.json_response({"success": False}, status=404)
+        return web.json_response({"success": True, "data": {"id": self.agent_id, "name": "Eliza"}})
+
+    async def _list_channels(self, request: web.Request) -> web.Response:
+        channels = [
+            {"id": channel_id, "name": channel["name"], "metadata": channel["metadata"]}
+            for channel_id, channel in self.channels.items()
+        ]
+        return web.json_response({"success": True, "data": {"channels": channels}})
+
+    async def _create_channel(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        channel_id = str(uuid.uuid4())
+        self.channels[channel_id] = {
+            "name": body["name"],
+            "metadata": body.get("metadata") or {},
+            "agents": set(),
+            "messages": [],
+        }
+        channel = {"id": channel_id, "name": body["name"]}
+        return web.json_response({"success": True, "data": {"channel": channel}}, status=201)
+
+    async def _details(self, request: web.Request) -> web.Response:
+        channel = self._channel(request)
+        if channel is None:
+            return self._not_found()
+        data = {"id": request.match_info["cid"], "name": channel["name"], "metadata": channel["metadata"]}
+        return web.json_response({"success": True, "data": data})
+
+    async def _patch_channel(self, request: web.Request) -> web.Response:
+        channel = self._channel(request)
+        if channel is None:
+            return self._not_found()
+        body = await request.json()
+        if body.get("name"):
+            channel["name"] = body["name"]
+        channel["metadata"].update(body.get("metadata") or {})
+        return web.json_response({"success": True, "data": {"id": request.match_info["cid"]}})
+
+    async def _delete_channel(self, request: web.Request) -> web.Response:
+        self.channels.pop(request.match_info["cid"], None)
+        return web.Response(status=204)
+
+    async def _channel_agents(self, request: web.Request) -> web.Response:
+        channel = self._channel(request)
+        if channel is None:
+            return self._not_found()
+        agents = [{"id": agent_id} for agent_id in channel["agents"]]
+        return web.json_response({"success": True, "data": {"agents": agents}})
+
+    async def _add_agent(self, request: web.Request) -> web.Response:
+        channel = self._channel(request)
+        if channel is None:
+            return self._not_found()
+        channel["agents"].add((await request.json())["agentId"])
+        return web.json_response({"success": True}, status=201)
+
+    async def _messages(self, request: web.Request) -> web.Response:
+        channel = self._channel(request)
+        if channel is None:
+            return self._not_found()
+        messages = sorted(channel["messages"], key=lambda msg: msg["created_at"], reverse=True)
+        if request.query.get("before"):
+            messages = [msg for msg in messages if msg["created_at"] < int(request.query["before"])]
+        limit = int(request.query.get("limit", 50))
+        return web.json_response({"success": True, "data": {"messages": messages[:limit]}})
+
+    async def _submit(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        channel_id = body["channel_id"]
+        if channel_id not in self.channels:
+            return self._not_found()
+        message = self._message(
+            channel_id,
+            body["author_id"],
+            body["content"],
+            body["source_type"],
+            body.get("in_reply_to_message_id"),
+        )
+        if body["source_type"] == "user_message":
+            asyncio.get_running_loop().create_task(self._reply(channel_id, message["id"], body["content"]))
+        return web.json_response({"success": True, "data": message}, status=201)
+
+    def _message(
+        self, channel_id: str, author_id: str, content: str, source_type: str, reply_to: Optional[str]
+    ) -> dict:
+        created_at = int(time.time() * 1000)
+        message = {
+            "id": str(uuid.uuid4()),
+            "channelId": channel_id,
+            "authorId": author_id,
+            "content": content,
+            "sourceType": source_type,
+            "inReplyToRootMessageId": reply_to,
+            "created_at": created_at,
+            "metadata": {},
+        }
+        self.channels[channel_id]["messages"].append(message)
+        return message
+
+    async def _reply(self, channel_id: str, message_id: str, text: str):
+        for part in range(self.parts):
+            await asyncio.sleep(self.reply_delay if part == 0 else self.part_gap)
+            if channel_id not in self.channels:
+                return
+            message = self._message(
+                channel_id, self.agent_id, f"Part {part + 1}: {text}", "agent_response", message_id
+            )
+            await self._sio.emit(
+                "messageBroadcast",
+                {
+                    "id": message["id"],
+                    "senderId": message["authorId"],
+                    "text": message["content"],
+                    "channelId": channel_id,
+                    "roomId": channel_id,
+                    "createdAt": message["created_at"],
+                    "source": message["sourceType"],
+                },
+                room=channel_id,
+            )
+            self.pushed += 1
+            if self.drop_sockets:
+                for sid in list(self._sio.manager.get_participants("/", channel_id)):
+                    await self._sio.disconnect(sid[0] if isinstance(sid, tuple) else sid)
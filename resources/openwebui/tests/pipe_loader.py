@@ -0,0 +1,14 @@
+"""Loads the single-file pipe functions, whose file names are not importable module names."""
+
+import importlib.util
+import os
+
+PIPES_DIR = os.path.join(os.path.dirname(__file__), os.pardir)
+
+
+def load_pipe(file_name: str, module_name: str):
+    """Load a fresh copy of a pipe, so no socket or session outlives a test's event loop"""
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(PIPES_DIR, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
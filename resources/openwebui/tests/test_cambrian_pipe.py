@@ -0,0 +1,77 @@
+"""Tests for the Cambrian pipe's NDJSON stream decoding."""
+
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("pydantic")
+
+sys.path.insert(0, os.path.dirname(__file__))
+from pipe_loader import load_pipe  # noqa: E402
+
+cambrian = load_pipe("function-Cambrian_Pipe.py", "cambrian_pipe_under_test")
+
+
+def line(value: dict) -> bytes:
+    return (json.dumps(value, ensure_ascii=False) + "\n").encode()
+
+
+def decode(*pieces: bytes, max_bytes: int = 1_000_000, max_line_length: int = 1000):
+    decoder = cambrian.NDJSONDecoder(max_bytes, max_line_length)
+    values = []
+    for piece in pieces:
+        values.extend(decoder.feed(piece))
+    values.extend(decoder.close())
+    return values, decoder
+
+
+def test_lines_split_across_reads_are_joined():
+    body = line({"type": "text", "text": "hello"}) + line({"type": "tool", "name": "swap_tokens"})
+    values, _ = decode(body[:5], body[5:30], body[30:])
+    assert values == [{"type": "text", "text": "hello"}, {"type": "tool", "name": "swap_tokens"}]
+
+
+def test_multibyte_characters_split_across_reads_survive():
+    body = line({"type": "text", "text": "gm ☀️ señor"})
+    cut = body.index("☀".encode()) + 1
+    values, _ = decode(body[:cut], body[cut:])
+    assert values == [{"type": "text", "text": "gm ☀️ señor"}]
+
+
+def test_last_line_needs_no_newline():
+    values, _ = decode(line({"n": 1}) + b'{"n": 2}')
+    assert values == [{"n": 1}, {"n": 2}]
+
+
+def test_blank_and_malformed_lines_are_skipped():
+    values, _ = decode(b'\n{"n": 1}\nnot json\n\n{"n": 2}\n')
+    assert values == [{"n": 1}, {"n": 2}]
+
+
+def test_overlong_line_is_dropped_and_the_rest_kept():
+    long_line = line({"text": "x" * 100})
+    values, decoder = decode(line({"n": 1}) + long_line + line({"n": 2}), max_line_length=50)
+    assert values == [{"n": 1}, {"n": 2}]
+    assert decoder.dropped_lines == 1
+
+
+def test_overlong_line_spanning_reads_is_dropped_without_buffering():
+    long_line = line({"text": "x" * 100})
+    decoder = cambrian.NDJSONDecoder(1_000_000, 50)
+    assert decoder.feed(long_line[:60]) == []
+    assert decoder._buffer == ""
+    assert decoder.feed(long_line[60:] + line({"n": 2})) == [{"n": 2}]
+    assert decoder.close() == []
+    assert decoder.dropped_lines == 1
+
+
+def test_input_past_max_bytes_is_truncated():
+    first = line({"n": 1})
+    values, decoder = decode(first + b'{"n": 2', line({"n": 3}), max_bytes=len(first) + 3)
+    # The cut-off line is never parsed, and nothing after the limit is read
+    assert values == [{"n": 1}]
+    assert decoder.truncated
+    assert decoder.received == len(first) + 3
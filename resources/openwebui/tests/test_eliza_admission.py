@@ -0,0 +1,158 @@
+"""Tests for the Eliza pipe's AdmissionQueue."""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("pydantic")
+
+sys.path.insert(0, os.path.dirname(__file__))
+from pipe_loader import load_pipe  # noqa: E402
+
+eliza = load_pipe("function-Eliza_Pipe.py", "eliza_pipe_admission")
+
+
+async def no_report(position: int):
+    pass
+
+
+def no_deadline(limit: float) -> float:
+    return limit
+
+
+async def settle():
+    """Let every task that can run do so"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_free_slots_admit_without_waiting():
+    async def main():
+        queue = eliza.AdmissionQueue()
+        queue.configure(2)
+        await queue.acquire("a", no_report, 1.0, no_deadline)
+        await queue.acquire("a", no_report, 1.0, no_deadline)
+        assert queue.busy
+        queue.release()
+        assert not queue.busy
+
+    asyncio.run(main())
+
+
+def test_waiting_users_are_admitted_round_robin():
+    async def main():
+        queue = eliza.AdmissionQueue()
+        queue.configure(1)
+        await queue.acquire("holder", no_report, 1.0, no_deadline)
+        admitted = []
+
+        async def turn(user: str, name: str):
+            await queue.acquire(user, no_report, 1.0, no_deadline)
+            admitted.append(name)
+
+        # One user queues three turns before another user queues one
+        tasks = [asyncio.create_task(turn("a", f"a{i}")) for i in range(1, 4)]
+        await settle()
+        tasks.append(asyncio.create_task(turn("b", "b1")))
+        await settle()
+        for _ in tasks:
+            queue.release()
+            await settle()
+        await asyncio.gather(*tasks)
+        assert admitted == ["a1", "b1", "a2", "a3"]
+
+    asyncio.run(main())
+
+
+def test_waiting_turn_is_told_its_position():
+    async def main():
+        queue = eliza.AdmissionQueue()
+        queue.configure(1)
+        await queue.acquire("holder", no_report, 1.0, no_deadline)
+        positions = {"a": [], "b": []}
+
+        def report(user: str):
+            async def on_wait(position: int):
+                positions[user].append(position)
+            return on_wait
+
+        first = asyncio.create_task(queue.acquire("a", report("a"), 1.0, no_deadline))
+        await settle()
+        second = asyncio.create_task(queue.acquire("b", report("b"), 1.0, no_deadline))
+        await settle()
+        queue.release()
+        queue.release()
+        await asyncio.gather(first, second)
+        assert positions == {"a": [1], "b": [2]}
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def main():
+        queue = eliza.AdmissionQueue()
+        queue.configure(1)
+        await queue.acquire("holder", no_report, 1.0, no_deadline)
+        waiter = asyncio.create_task(queue.acquire("a", no_report, 1.0, no_deadline))
+        await settle()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        queue.release()
+        # The slot went back to the pool rather than to the cancelled turn
+        assert not queue.busy
+        await asyncio.wait_for(queue.acquire("b", no_report, 1.0, no_deadline), 1)
+
+    asyncio.run(main())
+
+
+def test_turn_giving_up_as_it_is_admitted_hands_the_slot_on():
+    async def main():
+        queue = eliza.AdmissionQueue()
+        queue.configure(1)
+        await queue.acquire("holder", no_report, 1.0, no_deadline)
+        reporting = asyncio.Event()
+
+        async def slow_report(position: int):
+            await reporting.wait()
+
+        def expired(limit: float) -> float:
+            raise eliza.DeadlineExceeded("out of time")
+
+        first = asyncio.create_task(queue.acquire("a", slow_report, 1.0, expired))
+        second = asyncio.create_task(queue.acquire("b", no_report, 1.0, no_deadline))
+        await settle()
+        # The first turn is admitted while still reporting, then finds its time is up
+        queue.release()
+        reporting.set()
+        with pytest.raises(eliza.DeadlineExceeded):
+            await first
+        await asyncio.wait_for(second, 1)
+        queue.release()
+        assert not queue.busy
+
+    asyncio.run(main())
+
+
+def test_deadline_ends_the_wait():
+    async def main():
+        queue = eliza.AdmissionQueue()
+        queue.configure(1)
+        await queue.acquire("holder", no_report, 1.0, no_deadline)
+        deadline = asyncio.get_running_loop().time() + 0.2
+
+        def remaining(limit: float) -> float:
+            left = deadline - asyncio.get_running_loop().time()
+            if left <= 0:
+                raise eliza.DeadlineExceeded("out of time")
+            return min(limit, left)
+
+        with pytest.raises(eliza.DeadlineExceeded):
+            await queue.acquire("a", no_report, 0.05, remaining)
+        queue.release()
+        assert not queue.busy
+
+    asyncio.run(main())
@@ -0,0 +1,154 @@
+"""Reply delivery tests for the Eliza pipe against a fake Eliza server."""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("pydantic")
+pytest.importorskip("socketio")
+
+sys.path.insert(0, os.path.dirname(__file__))
+from fake_eliza import FakeEliza  # noqa: E402
+from pipe_loader import load_pipe  # noqa: E402
+
+MESSAGES = "GET /api/messaging/central-channels/{cid}/messages"
+
+
+def load_pipe_module():
+    return load_pipe("function-Eliza_Pipe.py", "eliza_pipe_under_test")
+
+
+@pytest.fixture
+def fake():
+    server = FakeEliza(reply_delay=0.2, parts=3, part_gap=0.2)
+    server.start()
+    yield server
+    server.stop()
+
+
+def make_pipe(module, fake: FakeEliza, **valves):
+    pipe = module.Pipe()
+    pipe.valves.eliza_url = fake.url
+    pipe.valves.quiescence_window = 0.8
+    pipe.valves.request_deadline = 20.0
+    for name, value in valves.items():
+        setattr(pipe.valves, name, value)
+    return pipe
+
+
+async def send(pipe, chat_id: str, messages: list[dict]) -> str:
+    """Send one chat turn through the pipe as OpenWebUI would and return the streamed text"""
+    request_info = {"chat_id": chat_id, "message_id": f"{chat_id}-{len(messages)}"}
+
+    async def emit(event: dict):
+        request_info  # OpenWebUI's emitter closes over the request's ids
+
+    body = {"messages": messages}
+    return "".join([piece async for piece in pipe.pipe(body, __event_emitter__=emit)])
+
+
+def run(module, coro):
+    """Run coro to completion, then close the module's shared socket and HTTP session"""
+
+    async def main():
+        try:
+            return await coro
+        finally:
+            for eliza_socket in module._eliza_sockets.values():
+                if eliza_socket._client is not None:
+                    await eliza_socket._client.disconnect()
+            if module._http_session is not None:
+                await module._http_session.close()
+
+    return asyncio.run(main())
+
+
+def run_turn(fake: FakeEliza, content: str, **valves) -> tuple[str, dict]:
+    """Send one chat turn through a fresh pipe; return the streamed text and the stored reply"""
+    module = load_pipe_module()
+    messages = [{"role": "user", "content": content}]
+    text = run(module, send(make_pipe(module, fake, **valves), "chat", messages))
+    return text, messages[-1]
+
+
+def expected_reply(content: str, parts: int) -> str:
+    return "\n\n".join(f"Part {part}: {content}" for part in range(1, parts + 1))
+
+
+def test_socket_delivers_reply_without_polling(fake):
+    text, reply = run_turn(fake, "hello", delivery_mode="socket")
+    assert text == expected_reply("hello", 3)
+    assert reply == {"role": "assistant", "content": text}
+    assert fake.joins >= 1
+    assert fake.count(MESSAGES) == 0
+
+
+def test_poll_delivers_reply_without_socket(fake):
+    text, reply = run_turn(fake, "hello", delivery_mode="poll")
+    assert text == expected_reply("hello", 3)
+    assert reply["content"] == text
+    assert fake.joins == 0
+    assert fake.count(MESSAGES) > 0
+
+
+def test_dropped_socket_falls_back_to_polling(fake):
+    fake.drop_sockets = True
+    text, reply = run_turn(fake, "hello", delivery_mode="auto")
+    assert text == expected_reply("hello", 3)
+    assert reply["content"] == text
+    assert fake.joins >= 1
+    # The first part was pushed; the rest could only be read by polling
+    assert fake.count(MESSAGES) > 0
+
+
+def channels_with(fake: FakeEliza, content: str) -> set[str]:
+    return {
+        channel_id for channel_id, channel in fake.channels.items()
+        if any(msg["content"] == content for msg in channel["messages"])
+    }
+
+
+def test_workers_without_shared_store_never_share_pool_channels(fake):
+    fake.reply_delay = fake.part_gap = 0.05
+    module = load_pipe_module()
+    first, second = make_pipe(module, fake), make_pipe(module, fake)
+
+    async def chats():
+        # Each worker's first chat fills its pool; the next chats are served from the pools
+        for pipe, chat_id in ((first, "chatA0"), (second, "chatB0"), (first, "chatA1"), (second, "chatB1")):
+            await send(pipe, chat_id, [{"role": "user", "content": f"hello from {chat_id}"}])
+            await asyncio.sleep(0.3)
+
+    run(module, chats())
+    a1, b1 = channels_with(fake, "hello from chatA1"), channels_with(fake, "hello from chatB1")
+    assert len(a1) == 1 and len(b1) == 1
+    assert a1 != b1
+
+
+def test_chat_returning_after_eviction_keeps_its_context(fake):
+    fake.reply_delay = fake.part_gap = 0.05
+    module = load_pipe_module()
+    pipe = make_pipe(module, fake, channel_cache_size=2, channel_pool_size=0)
+    history = [{"role": "user", "content": "one"}]
+
+    async def chats():
+        await send(pipe, "c1", history)
+        # Two more chats push c1 out of the channel map, which retires its channel
+        for chat_id in ("c2", "c3"):
+            await send(pipe, chat_id, [{"role": "user", "content": chat_id}])
+            await asyncio.sleep(0.3)
+        history.append({"role": "user", "content": "one again"})
+        await send(pipe, "c1", history)
+
+    run(module, chats())
+    first, = channels_with(fake, "one")
+    assert fake.channels[first]["metadata"].get("archived")
+    returned = [
+        msg["content"] for channel in fake.channels.values() for msg in channel["messages"]
+        if msg["sourceType"] == "user_message" and msg["content"].endswith("one again")
+    ]
+    assert len(returned) == 1
+    assert returned[0].startswith("Context from earlier in this conversation:\nUser: one\nAssistant: Part 1: one")
@@ -0,0 +1,105 @@
+"""Tests for the Eliza pipe's shared state stores."""
+
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("pydantic")
+
+sys.path.insert(0, os.path.dirname(__file__))
+from pipe_loader import load_pipe  # noqa: E402
+
+eliza = load_pipe("function-Eliza_Pipe.py", "eliza_pipe_state_store")
+
+
+def test_sqlite_store_sets_gets_and_deletes(tmp_path):
+    store = eliza.SQLiteStateStore(str(tmp_path / "state.db"))
+
+    async def main():
+        assert await store.get("k") is None
+        await store.set("k", "one", 60)
+        assert await store.get("k") == "one"
+        await store.set("k", "two", 60)
+        assert await store.get("k") == "two"
+        await store.delete("k")
+        assert await store.get("k") is None
+
+    asyncio.run(main())
+
+
+def test_sqlite_store_add_keeps_the_first_live_value(tmp_path):
+    store = eliza.SQLiteStateStore(str(tmp_path / "state.db"))
+    other_worker = eliza.SQLiteStateStore(str(tmp_path / "state.db"))
+
+    async def main():
+        assert await store.add("k", "mine", 60) == "mine"
+        assert await other_worker.add("k", "theirs", 60) == "mine"
+        assert await other_worker.get("k") == "mine"
+
+    asyncio.run(main())
+
+
+def test_sqlite_store_values_expire(tmp_path):
+    store = eliza.SQLiteStateStore(str(tmp_path / "state.db"))
+
+    async def main():
+        await store.set("k", "old", 0.1)
+        await store.add("claim", "old", 0.1)
+        time.sleep(0.2)
+        assert await store.get("k") is None
+        # An expired claim can be taken over
+        assert await store.add("claim", "new", 60) == "new"
+
+    asyncio.run(main())
+
+
+def make_pipe(**valves):
+    pipe = eliza.Pipe()
+    for name, value in valves.items():
+        setattr(pipe.valves, name, value)
+    return pipe
+
+
+def test_memory_backend_has_no_shared_store():
+    pipe = make_pipe(state_backend="memory")
+
+    async def main():
+        assert pipe._get_store() is None
+        # Every claim succeeds, so callers must not rely on it to exclude other workers
+        assert await pipe._store_add("k", "one", 60) == "one"
+        assert await pipe._store_add("k", "two", 60) == "two"
+        assert await pipe._store_get("k") is None
+
+    asyncio.run(main())
+
+
+def test_pipe_claims_through_the_sqlite_backend(tmp_path):
+    path = str(tmp_path / "state.db")
+    first, second = make_pipe(state_backend="sqlite", sqlite_path=path), make_pipe(
+        state_backend="sqlite", sqlite_path=path
+    )
+
+    async def main():
+        key = first._state_key("pooled", "channel-1")
+        assert await first._store_add(key, "chat-a", 60) == "chat-a"
+        assert await second._store_add(key, "chat-b", 60) == "chat-a"
+        assert await second._store_get(key) == "chat-a"
+
+    asyncio.run(main())
+
+
+def test_unreachable_store_falls_back_to_local_state(tmp_path):
+    # A directory cannot be opened as a database, so every store call fails
+    pipe = make_pipe(state_backend="sqlite", sqlite_path=str(tmp_path))
+
+    async def main():
+        await pipe._store_set("k", "one", 60)
+        assert await pipe._store_get("k") is None
+        assert await pipe._store_add("k", "one", 60) == "one"
+        await pipe._store_delete("k")
+
+    asyncio.run(main())